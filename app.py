@@ -2,24 +2,66 @@ import os
 import json
 import time
 import random
-import requests
 import re
+import html
 import atexit
+import functools
 from datetime import datetime
-from telebot import TeleBot, types
-from telebot.util import quick_markup
-from dotenv import load_dotenv
-from deep_translator import GoogleTranslator
 import threading
-from collections import defaultdict
-from flask import Flask, jsonify
+import math
+import heapq
+import contextlib
+import hmac
+import hashlib
+import sqlite3
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from collections import defaultdict, deque, namedtuple, OrderedDict
 import logging
 
+# ================== STARTUP PROFILE ==================
+# Wall time of each import/init phase, kept for the status endpoint and printed
+# when STARTUP_PROFILE is set. Phases run on the warmup thread are included.
+STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE', '').lower() in ("1", "true", "yes")
+startup_phases = {}
+startup_clock = [time.perf_counter()]
+
+def startup_phase(name, clock=startup_clock):
+    """Record the time since the previous phase on the same clock"""
+    now = time.perf_counter()
+    startup_phases[name] = round((now - clock[0]) * 1000, 1)
+    clock[0] = now
+
+def report_startup_profile(stage):
+    if STARTUP_PROFILE:
+        print(f"⏱ Startup profile ({stage}):")
+        for name, ms in startup_phases.items():
+            print(f"   {name:<24}{ms:>9.1f} ms")
+
+startup_phase("stdlib imports")
+import requests
+from requests.adapters import HTTPAdapter
+startup_phase("import requests")
+from telebot import TeleBot, types, apihelper
+from telebot.util import quick_markup
+startup_phase("import telebot")
+from flask import Flask, jsonify, request
+startup_phase("import flask")
+from dotenv import load_dotenv
+startup_phase("import dotenv")
+
 # ================== CONFIGURATION ==================
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_TOKEN")
 GROQ_KEY = os.getenv("GROQ_API_KEY")
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+GROQ_STREAMING = os.getenv("GROQ_STREAMING", "").lower() in ("1", "true", "yes")  # show replies while they generate
 PORT = int(os.environ.get('PORT', 10000))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip('/')  # set to switch from polling to webhook mode
+# Upstream endpoints; overridden by loadtest.py to point at its local stand-ins
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # e.g. http://127.0.0.1:8081/bot{0}/{1}
+DICTIONARY_API_URL = os.getenv("DICTIONARY_API_URL", "https://api.dictionaryapi.dev/api/v2/entries/en/")
+TRANSLATOR_URL = os.getenv("TRANSLATOR_URL", "https://translate.google.com/m")  # the endpoint deep_translator scrapes
 
 # Disable excessive logging
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
@@ -29,19 +71,270 @@ if not TOKEN:
     print("❌ ERROR: TELEGRAM_TOKEN not found")
     exit(1)
 
-bot = TeleBot(TOKEN)
+# ================== METRICS ==================
+# Minimal Prometheus-style registry: labelled histograms and counters, rendered
+# as text exposition format on /metrics.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+metric_histograms = {}  # name -> {label tuple: [bucket counts, sum, count]}
+metric_counters = {}  # name -> {label tuple: value}
+metrics_lock = threading.Lock()
 
-# Validate bot token
-try:
-    bot_info = bot.get_me()
-    BOT_USERNAME = bot_info.username
-    BOT_NAME = "Miss Tristin 💅"
-    print(f"✅ Bot authenticated: @{BOT_USERNAME}")
-except Exception as e:
-    print(f"❌ Invalid bot token: {e}")
-    exit(1)
+def observe(name, seconds, **labels):
+    key = tuple(sorted(labels.items()))
+    with metrics_lock:
+        series = metric_histograms.setdefault(name, {}).get(key)
+        if series is None:
+            series = metric_histograms[name][key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                series[0][i] += 1
+                break
+        series[1] += seconds
+        series[2] += 1
+
+def inc_counter(name, value=1, **labels):
+    key = tuple(sorted(labels.items()))
+    with metrics_lock:
+        series = metric_counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+def timed(handler):
+    """Record every call of a bot handler in tristin_handler_duration_seconds"""
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        started = time.time()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            observe("tristin_handler_duration_seconds", time.time() - started, handler=handler.__name__)
+    return wrapper
+
+def escape_label_value(value):
+    """Backslash, double quote and newline must be escaped in Prometheus label values"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label_value(v)}"' for k, v in labels) + "}"
+
+def render_metrics(gauges, counters):
+    """Render the registry plus scrape-time gauges/counters, given as name -> [(labels, value)]"""
+    lines = []
+    with metrics_lock:
+        for name, series in metric_histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, (buckets, total, count) in series.items():
+                cumulative = 0
+                for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                    cumulative += bucket
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        for name, series in metric_counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+    for kind, snapshot in (("gauge", gauges), ("counter", counters)):
+        for name, series in snapshot.items():
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {value}")
+    return "\n".join(lines) + "\n"
+
+# ================== HTTP CLIENT ==================
+# One pooled keep-alive session shared by Groq, the dictionary API and the
+# Telegram bot, with per-upstream latency histograms.
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 32))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 2))
+HTTP_BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE', 0.3))
+HTTP_BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', 5))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+http_session = requests.Session()
+http_adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+http_session.mount('https://', http_adapter)
+http_session.mount('http://', http_adapter)
+def record_latency(upstream, seconds, error=False):
+    observe("tristin_upstream_duration_seconds", seconds, upstream=upstream)
+    if error:
+        inc_counter("tristin_upstream_errors_total", upstream=upstream)
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), HTTP_BACKOFF_MAX)
+    # Full jitter so retries from many workers don't arrive in lockstep
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+# ================== CIRCUIT BREAKERS ==================
+# Groq, the dictionary API and the translator each sit behind a breaker. Once
+# BREAKER_MIN_CALLS of the last BREAKER_WINDOW calls have finished and at least
+# BREAKER_FAILURE_RATE of them failed (an error, 5xx/429, or slower than the
+# breaker's slow_after), the breaker opens: calls fail at once with CircuitOpen
+# and the callers' usual fallbacks are served. After BREAKER_COOLDOWN seconds a
+# single probe is let through (half-open); it closes the breaker on success and
+# reopens it on failure. Timeouts follow recent latency: BREAKER_TIMEOUT_FACTOR
+# times the p95 of recent successful calls, kept between the breaker's floor
+# and its ceiling (the timeout used before there are enough samples).
+BREAKER_WINDOW = int(os.environ.get('BREAKER_WINDOW', 20))
+BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', 5))
+BREAKER_FAILURE_RATE = float(os.environ.get('BREAKER_FAILURE_RATE', 0.5))
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', 15))
+BREAKER_TIMEOUT_FACTOR = float(os.environ.get('BREAKER_TIMEOUT_FACTOR', 3))
+BREAKER_LATENCY_SAMPLES = 50
+
+class CircuitOpen(requests.RequestException):
+    """The upstream's breaker is open, so the call was not made"""
+
+class CircuitBreaker:
+    def __init__(self, name, timeout, timeout_floor, slow_after):
+        self.name = name
+        self.timeout_ceiling = timeout
+        self.timeout_floor = timeout_floor
+        self.slow_after = slow_after
+        self.lock = threading.Lock()
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)  # True for failed/slow calls
+        self.latencies = deque(maxlen=BREAKER_LATENCY_SAMPLES)  # successful calls only
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+        self.rejected = 0
+    
+    def allow(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN:
+                self.state = "half_open"
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            self.rejected += 1
+            return False
+    
+    def record(self, seconds, error=False):
+        failed = error or seconds > self.slow_after
+        with self.lock:
+            if not error:
+                self.latencies.append(seconds)
+            if self.state == "half_open":
+                self.probing = False
+                if failed:
+                    self.trip()
+                else:
+                    self.state = "closed"
+                    self.outcomes.clear()
+                    print(f"✅ {self.name} circuit closed")
+                return
+            if self.state != "closed":
+                return  # a call that started before the breaker opened
+            self.outcomes.append(failed)
+            if len(self.outcomes) >= BREAKER_MIN_CALLS and sum(self.outcomes) >= BREAKER_FAILURE_RATE * len(self.outcomes):
+                self.trip()
+    
+    def trip(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        print(f"⚡ {self.name} circuit open for {BREAKER_COOLDOWN:.0f}s")
+    
+    def p95(self):
+        with self.lock:
+            samples = sorted(self.latencies)
+        return samples[int(len(samples) * 0.95)] if len(samples) >= BREAKER_MIN_CALLS else None
+    
+    def timeout(self):
+        p95 = self.p95()
+        if p95 is None:
+            return self.timeout_ceiling
+        return max(self.timeout_floor, min(self.timeout_ceiling, p95 * BREAKER_TIMEOUT_FACTOR))
+    
+    def stats(self):
+        p95 = self.p95()
+        timeout = self.timeout()
+        with self.lock:
+            return {"state": self.state, "timeout_s": round(timeout, 2),
+                    "trips": self.trips, "rejected": self.rejected,
+                    "recent_failures": sum(self.outcomes), "recent_calls": len(self.outcomes),
+                    "p95_ms": round(p95 * 1000, 1) if p95 is not None else None}
+
+breakers = {
+    "groq": CircuitBreaker("groq", timeout=12, timeout_floor=3, slow_after=8),
+    "dictionary": CircuitBreaker("dictionary", timeout=10, timeout_floor=2, slow_after=5),
+    "translator": CircuitBreaker("translator", timeout=10, timeout_floor=3, slow_after=5),
+}
+
+def get_breaker_stats():
+    return {name: b.stats() for name, b in breakers.items()}
+
+def http_request(upstream, method, url, retry=True, **kwargs):
+    attempts = HTTP_MAX_RETRIES + 1 if retry else 1
+    breaker = breakers.get(upstream)
+    for attempt in range(attempts):
+        if breaker:
+            if not breaker.allow():
+                raise CircuitOpen(f"{upstream} circuit is open")
+            kwargs['timeout'] = breaker.timeout()
+        started = time.time()
+        try:
+            r = http_session.request(method, url, **kwargs)
+        except requests.ConnectionError:
+            # Connection failures never reached the server, so they are safe to retry;
+            # read timeouts are not retried to keep the worst case at one timeout.
+            record_latency(upstream, time.time() - started, error=True)
+            if breaker:
+                breaker.record(time.time() - started, error=True)
+            if attempt == attempts - 1:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        except requests.RequestException:
+            record_latency(upstream, time.time() - started, error=True)
+            if breaker:
+                breaker.record(time.time() - started, error=True)
+            raise
+        record_latency(upstream, time.time() - started, error=r.status_code >= 400)
+        if breaker:
+            breaker.record(time.time() - started, error=r.status_code in RETRY_STATUSES)
+        if r.status_code in RETRY_STATUSES and attempt < attempts - 1:
+            time.sleep(backoff_delay(attempt, r.headers.get('Retry-After')))
+            continue
+        return r
+
+def send_telegram_request(method, url, **kwargs):
+    api_method = url.rsplit('/', 1)[-1]
+    chat_id = (kwargs.get('params') or {}).get('chat_id')
+    if api_method in GATED_METHODS and chat_id is not None:
+        # telebot passes chat_id as str for some methods and int for others
+        return send_gated(GATED_METHODS[api_method], str(chat_id), method, url, kwargs)
+    # getUpdates long-polls, so keep it out of the Telegram latency histogram
+    upstream = "telegram_poll" if api_method == "getUpdates" else "telegram"
+    return http_request(upstream, method, url, retry=False, **kwargs)
+
+def get_upstream_stats():
+    with metrics_lock:
+        latency = metric_histograms.get("tristin_upstream_duration_seconds", {})
+        errors = metric_counters.get("tristin_upstream_errors_total", {})
+        return {dict(labels)["upstream"]: {"count": count, "errors": errors.get(labels, 0),
+                                           "avg_ms": round(total / count * 1000, 1) if count else 0.0}
+                for labels, (_, total, count) in latency.items()}
+
+apihelper.CUSTOM_REQUEST_SENDER = send_telegram_request
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL
+
+bot = TeleBot(TOKEN, threaded=False)  # handlers run on our own dispatch workers
+
+# Filled in by authenticate() on the warmup thread
+bot_info = None
+BOT_USERNAME = None
+BOT_NAME = "Miss Tristin 💅"
 
 START_TIME = time.time()
+startup_phase("config and http client")
 
 # ================== RENDER VS LOCAL ==================
 IS_RENDER = 'RENDER' in os.environ
@@ -50,10 +343,16 @@ if IS_RENDER:
     USERS_FILE = "/tmp/users.json"
     VERIFIED_FILE = "/tmp/verified.json"
     CONVERSATIONS_FILE = "/tmp/conversations.json"
+    CONVERSATIONS_DB_FILE = "/tmp/conversations.db"
+    DATA_LOG_FILE = "/tmp/data.log"
+    LOOKUP_CACHE_FILE = "/tmp/lookup_cache.json"
 else:
     USERS_FILE = "users.json"
     VERIFIED_FILE = "verified.json"
     CONVERSATIONS_FILE = "conversations.json"
+    CONVERSATIONS_DB_FILE = "conversations.db"
+    DATA_LOG_FILE = "data.log"
+    LOOKUP_CACHE_FILE = "lookup_cache.json"
     os.makedirs("data", exist_ok=True)
 
 # Channel list for verification
@@ -63,62 +362,517 @@ CHANNELS = ["heiscoded", "evilpriest01", "Dev_Collins_Python_Lab"]
 DEV1_USERNAME = "@Just_Collins101"
 DEV2_USERNAME = "@heis_tomi"
 
+# ================== STATE BACKEND ==================
+# State that several bot processes must agree on (dedupe, cooldowns, spam
+# windows, conversation memory, verified users and user counters) goes through
+# one of these backends, chosen with STATE_BACKEND:
+#   memory              - in-process only (default, single worker)
+#   sqlite:///path.db   - shared by every process on the host
+#   redis://host:6379/0 - shared across hosts; needs the `redis` package
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory')
+CONVERSATION_STATE_TTL = int(os.environ.get('CONVERSATION_STATE_TTL', 7 * 86400))
+
+class MemoryStateBackend:
+    shared = False
+    
+    def __init__(self):
+        self.values = {}  # key -> (value, expires_at or None)
+        self.events = defaultdict(deque)
+        self.sets = defaultdict(set)
+        self.lock = threading.Lock()
+    
+    def claim(self, key, ttl):
+        """Set key if absent (or expired); True if this caller got it"""
+        now = time.time()
+        with self.lock:
+            entry = self.values.get(key)
+            if entry and (entry[1] is None or entry[1] > now):
+                return False
+            self.values[key] = ("1", now + ttl)
+            return True
+    
+    def hit(self, key, window):
+        """Record an event now and return how many fell inside the last `window` seconds"""
+        now = time.time()
+        with self.lock:
+            events = self.events[key]
+            events.append(now)
+            while events and now - events[0] >= window:
+                events.popleft()
+            return len(events)
+    
+    def recent(self, key, window):
+        """How many events fell inside the last `window` seconds, without recording one"""
+        now = time.time()
+        with self.lock:
+            return sum(1 for ts in self.events.get(key, ()) if now - ts < window)
+    
+    def get(self, key):
+        entry = self.values.get(key)
+        if entry and (entry[1] is None or entry[1] > time.time()):
+            return entry[0]
+        return None
+    
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.values[key] = (value, time.time() + ttl if ttl else None)
+    
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+    
+    def incr(self, key, amount=1):
+        with self.lock:
+            value = int(self.get(key) or 0) + amount
+            self.values[key] = (str(value), None)
+            return value
+    
+    def add(self, name, member):
+        """Add member to the named set; True if it wasn't there yet"""
+        with self.lock:
+            members = self.sets[name]
+            if member in members:
+                return False
+            members.add(member)
+            return True
+    
+    def remove(self, name, member):
+        with self.lock:
+            members = self.sets.get(name)
+            if not members or member not in members:
+                return False
+            members.discard(member)
+            return True
+    
+    def contains(self, name, member):
+        return member in self.sets.get(name, ())
+    
+    def members(self, name):
+        with self.lock:
+            return list(self.sets.get(name, ()))
+    
+    def count(self, name):
+        return len(self.sets.get(name, ()))
+    
+    def purge(self, max_window):
+        now = time.time()
+        with self.lock:
+            for key in [k for k, (_, expires_at) in self.values.items() if expires_at and expires_at <= now]:
+                del self.values[key]
+            for key in [k for k, events in self.events.items() if not events or now - events[-1] >= max_window]:
+                del self.events[key]
+
+class SQLiteStateBackend:
+    shared = True
+    
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS events (key TEXT, ts REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS events_key_ts ON events (key, ts)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sets (name TEXT, member TEXT, PRIMARY KEY (name, member)) WITHOUT ROWID")
+        self.lock = threading.Lock()
+    
+    def claim(self, key, ttl):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM kv WHERE key = ? AND expires_at IS NOT NULL AND expires_at <= ?", (key, now))
+                claimed = self.conn.execute("INSERT OR IGNORE INTO kv VALUES (?, '1', ?)", (key, now + ttl)).rowcount == 1
+            finally:
+                self.conn.execute("COMMIT")
+        return claimed
+    
+    def hit(self, key, window):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM events WHERE key = ? AND ts <= ?", (key, now - window))
+                self.conn.execute("INSERT INTO events VALUES (?, ?)", (key, now))
+                count = self.conn.execute("SELECT COUNT(*) FROM events WHERE key = ?", (key,)).fetchone()[0]
+            finally:
+                self.conn.execute("COMMIT")
+        return count
+    
+    def recent(self, key, window):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM events WHERE key = ? AND ts > ?",
+                                     (key, time.time() - window)).fetchone()[0]
+    
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                                    (key, time.time())).fetchone()
+        return row[0] if row else None
+    
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, value, time.time() + ttl if ttl else None))
+    
+    def delete(self, key):
+        with self.lock:
+            self.conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+    
+    def incr(self, key, amount=1):
+        with self.lock:
+            return self.conn.execute(
+                "INSERT INTO kv VALUES (?, ?, NULL) ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value "
+                "RETURNING CAST(value AS INTEGER)", (key, amount)).fetchone()[0]
+    
+    def add(self, name, member):
+        with self.lock:
+            return self.conn.execute("INSERT OR IGNORE INTO sets VALUES (?, ?)", (name, member)).rowcount == 1
+    
+    def remove(self, name, member):
+        with self.lock:
+            return self.conn.execute("DELETE FROM sets WHERE name = ? AND member = ?", (name, member)).rowcount == 1
+    
+    def contains(self, name, member):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM sets WHERE name = ? AND member = ?", (name, member)).fetchone() is not None
+    
+    def members(self, name):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT member FROM sets WHERE name = ?", (name,))]
+    
+    def count(self, name):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sets WHERE name = ?", (name,)).fetchone()[0]
+    
+    def purge(self, max_window):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self.conn.execute("DELETE FROM events WHERE ts <= ?", (now - max_window,))
+
+class RedisStateBackend:
+    shared = True
+    
+    def __init__(self, client):
+        # Any redis-py compatible client works, e.g. fakeredis for local testing
+        self.client = client
+    
+    def claim(self, key, ttl):
+        return bool(self.client.set(key, "1", nx=True, px=int(ttl * 1000)))
+    
+    def hit(self, key, window):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(key, 0, now - window)
+        pipe.zadd(key, {f"{now}:{random.random()}": now})
+        pipe.zcard(key)
+        pipe.pexpire(key, int(window * 1000))
+        return pipe.execute()[2]
+    
+    def recent(self, key, window):
+        return self.client.zcount(key, f"({time.time() - window}", "+inf")
+    
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+    
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+    
+    def delete(self, key):
+        self.client.delete(key)
+    
+    def incr(self, key, amount=1):
+        return self.client.incrby(key, amount)
+    
+    def add(self, name, member):
+        return self.client.sadd(f"set:{name}", member) == 1
+    
+    def remove(self, name, member):
+        return self.client.srem(f"set:{name}", member) == 1
+    
+    def contains(self, name, member):
+        return bool(self.client.sismember(f"set:{name}", member))
+    
+    def members(self, name):
+        return [m.decode('utf-8') if isinstance(m, bytes) else m for m in self.client.smembers(f"set:{name}")]
+    
+    def count(self, name):
+        return self.client.scard(f"set:{name}")
+    
+    def purge(self, max_window):
+        pass  # redis expires keys by itself
+
+def create_state_backend(spec):
+    if spec.startswith('sqlite:///'):
+        return SQLiteStateBackend(spec[len('sqlite:///'):])
+    if spec.startswith(('redis://', 'rediss://')):
+        try:
+            import redis
+        except ImportError:
+            print("❌ STATE_BACKEND is redis but the `redis` package is not installed")
+            exit(1)
+        return RedisStateBackend(redis.Redis.from_url(spec))
+    return MemoryStateBackend()
+
+state_backend = create_state_backend(STATE_BACKEND)
+startup_phase("state backend")
+
 # ================== CONVERSATION MEMORY ==================
-conversation_history = {}
-MAX_HISTORY_PER_USER = 5
+# One ring buffer per (user, chat), stored under "<user_id>_<chat_id>". Each
+# exchange is rendered into prompt text once when it is added, and the joined
+# context is cached on the conversation until the next append.
+MAX_HISTORY_PER_USER = int(os.environ.get('MAX_HISTORY_PER_USER', 5))
+MAX_EXCHANGE_CHARS = int(os.environ.get('MAX_EXCHANGE_CHARS', 100))
+CONTEXT_EXCHANGES = 3
+# 0 keeps the last CONTEXT_EXCHANGES exchanges; otherwise as many recent ones as fit in this many tokens
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 0))
+# Only this many conversations stay in RAM; the rest live in CONVERSATIONS_DB_FILE until their next message
+CONVERSATION_HOT_LIMIT = int(os.environ.get('CONVERSATION_HOT_LIMIT', 1000))
+CONVERSATION_IDLE_TIMEOUT = float(os.environ.get('CONVERSATION_IDLE_TIMEOUT', 1800))
 
-def load_conversations():
-    global conversation_history
-    try:
-        if os.path.exists(CONVERSATIONS_FILE):
-            with open(CONVERSATIONS_FILE, 'r', encoding='utf-8') as f:
-                conversation_history = json.load(f)
-            print(f"💬 Loaded {len(conversation_history)} conversations")
-    except Exception as e:
-        print(f"⚠️ Could not load conversations: {e}")
-        conversation_history = {}
+def estimate_tokens(text):
+    return len(text) // 4 + 1  # ~4 characters per token for English chat
 
-def save_conversations():
-    try:
-        with open(CONVERSATIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(conversation_history, f, indent=2, ensure_ascii=False)
-        return True
-    except Exception as e:
-        print(f"❌ Error saving conversations: {e}")
-        return False
+class Exchange:
+    __slots__ = ("user", "bot", "ts", "rendered", "tokens")
+    
+    def __init__(self, user, bot, ts):
+        self.user = user[:MAX_EXCHANGE_CHARS]
+        self.bot = bot[:MAX_EXCHANGE_CHARS]
+        self.ts = ts
+        self.rendered = f"User: {self.user}\nMiss Tristin: {self.bot}"
+        self.tokens = estimate_tokens(self.rendered)
+    
+    def to_json(self):
+        return {"user": self.user, "bot": self.bot, "ts": self.ts}
 
-def add_to_history(user_id, user_message, bot_response):
-    user_id_str = str(user_id)
-    if user_id_str not in conversation_history:
-        conversation_history[user_id_str] = []
+class Conversation:
+    __slots__ = ("exchanges", "context")
     
-    conversation_history[user_id_str].append({
-        "user": user_message[:100],
-        "bot": bot_response[:100],
-        "timestamp": time.time()
-    })
+    def __init__(self, exchanges=()):
+        self.exchanges = deque(exchanges, maxlen=MAX_HISTORY_PER_USER)
+        self.context = None
+    
+    def add(self, exchange):
+        self.exchanges.append(exchange)
+        self.context = None
     
-    if len(conversation_history[user_id_str]) > MAX_HISTORY_PER_USER:
-        conversation_history[user_id_str] = conversation_history[user_id_str][-MAX_HISTORY_PER_USER:]
+    def render(self):
+        if self.context is None:
+            self.context = build_context(self.exchanges)
+        return self.context
     
-    if random.random() < 0.3:
-        save_conversations()
+    def to_json(self):
+        return [exchange.to_json() for exchange in self.exchanges]
 
-def get_conversation_context(user_id):
-    user_id_str = str(user_id)
-    if user_id_str not in conversation_history:
-        return ""
+def build_context(exchanges):
+    if CONTEXT_TOKEN_BUDGET <= 0:
+        return "\n".join(exchange.rendered for exchange in list(exchanges)[-CONTEXT_EXCHANGES:])
+    picked, used = [], 0
+    for exchange in reversed(exchanges):
+        if used + exchange.tokens > CONTEXT_TOKEN_BUDGET:
+            break
+        picked.append(exchange.rendered)
+        used += exchange.tokens
+    return "\n".join(reversed(picked))
+
+def conversation_key(user_id, chat_id):
+    return f"{user_id}_{chat_id}"
+
+def parse_conversation(key, entries):
+    """Build a Conversation from the current schema or either legacy one; returns (key, conversation)"""
+    exchanges, pending_user = [], None
+    for entry in entries or []:
+        if "role" in entry:  # legacy: OpenAI-style turns
+            if entry["role"] == "user":
+                pending_user = entry.get("content", "")
+            elif entry["role"] == "assistant" and pending_user is not None:
+                exchanges.append(Exchange(pending_user, entry.get("content", ""), 0))
+                pending_user = None
+        else:
+            exchanges.append(Exchange(entry.get("user", ""), entry.get("bot", ""),
+                                      entry.get("ts", entry.get("timestamp", 0))))
+    if "_" not in key:
+        key = conversation_key(key, key)  # legacy per-user history: file it under the private chat
+    return key, Conversation(exchanges)
+
+class ConversationStore:
+    """Hot LRU of Conversation objects in front of a SQLite table of every conversation"""
     
-    history = conversation_history[user_id_str]
-    if not history:
-        return ""
+    def __init__(self, path, hot_limit):
+        self.hot = OrderedDict()  # key -> [conversation, last_used]
+        self.hot_limit = hot_limit
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.fresh = self.conn.execute("PRAGMA user_version").fetchone()[0] == 0
+        self.conn.execute("CREATE TABLE IF NOT EXISTS conversations (key TEXT PRIMARY KEY, exchanges TEXT, updated_at REAL)")
+        self.conn.execute("PRAGMA user_version = 1")
+        self.count = self.conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        self.spilled = {}  # pushed out of the hot set but not written yet; the flusher writes them
+        self.page_ins = 0
+        self.spills = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def read_cold(self, key):
+        row = self.conn.execute("SELECT exchanges FROM conversations WHERE key = ?", (key,)).fetchone()
+        return parse_conversation(key, json.loads(row[0]))[1] if row else None
+    
+    def write_cold(self, items):
+        now = time.time()
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                                  [(key, json.dumps(conversation.to_json(), ensure_ascii=False), now)
+                                   for key, conversation in items])
+        finally:
+            self.conn.execute("COMMIT")
+    
+    def get(self, key):
+        """Conversation for key, paging it in from disk if it went cold; None if there is none"""
+        with self.lock:
+            entry = self.hot.get(key)
+            if entry is None:
+                conversation = self.spilled.pop(key, None)
+                if conversation is None:
+                    conversation = self.read_cold(key)
+                    if conversation is None:
+                        return None
+                    self.page_ins += 1
+                entry = self.hot[key] = [conversation, 0]
+                self.evict_overflow()
+            self.hot.move_to_end(key)
+            entry[1] = time.time()
+            return entry[0]
+    
+    def put(self, key, conversation):
+        with self.lock:
+            if key not in self.hot and key not in self.spilled and self.read_cold(key) is None:
+                self.count += 1
+            self.spilled.pop(key, None)
+            self.hot[key] = [conversation, time.time()]
+            self.hot.move_to_end(key)
+            self.evict_overflow()
+    
+    def append(self, key, exchange):
+        """Add an exchange to key's conversation; under the lock so the flusher never serializes one mid-change"""
+        with self.lock:
+            conversation = self.get(key)
+            if conversation is None:
+                conversation = Conversation()
+                self.put(key, conversation)
+            conversation.add(exchange)
+    
+    def context(self, key):
+        with self.lock:
+            conversation = self.get(key)
+            return conversation.render() if conversation else ""
+    
+    def pop(self, key):
+        with self.lock:
+            removed = self.hot.pop(key, None) is not None
+            removed = self.spilled.pop(key, None) is not None or removed
+            removed = self.conn.execute("DELETE FROM conversations WHERE key = ?", (key,)).rowcount > 0 or removed
+            if removed:
+                self.count -= 1
+    
+    def evict_overflow(self):
+        # Only moves them aside: handler threads never wait on a disk write
+        while len(self.hot) > self.hot_limit:
+            key, (conversation, _) = self.hot.popitem(last=False)
+            self.spilled[key] = conversation
+        if len(self.spilled) >= FLUSH_BATCH_SIZE:
+            flush_wakeup.set()
+    
+    def write_spilled(self):
+        with self.lock:
+            items = list(self.spilled.items())
+            if items:
+                self.write_cold(items)
+                self.spilled.clear()
+                self.spills += len(items)
+        return len(items)
+    
+    def evict_idle(self, max_idle):
+        """Spill conversations nobody has touched for max_idle seconds"""
+        cutoff = time.time() - max_idle
+        with self.lock:
+            spilled = []
+            for key, (conversation, last_used) in self.hot.items():
+                if last_used > cutoff:
+                    break  # LRU order: everything after this was used more recently
+                spilled.append((key, conversation))
+            for key, _ in spilled:
+                del self.hot[key]
+            if spilled:
+                self.write_cold(spilled)
+                self.spills += len(spilled)
+        return len(spilled)
     
-    context_parts = []
-    for exchange in history[-3:]:
-        context_parts.append(f"User: {exchange['user']}")
-        context_parts.append(f"Miss Tristin: {exchange['bot']}")
+    def write_back(self, keys):
+        """Persist the hot copies of keys; cold ones were already written when they were spilled"""
+        with self.lock:
+            items = [(key, self.hot[key][0]) for key in keys if key in self.hot]
+            if items:
+                self.write_cold(items)
+        return len(items)
     
-    return "\n".join(context_parts)
+    def stats(self):
+        return {"stored": self.count, "hot": len(self.hot), "spilling": len(self.spilled),
+                "page_ins": self.page_ins, "spills": self.spills}
+
+conversation_history = ConversationStore(CONVERSATIONS_DB_FILE, CONVERSATION_HOT_LIMIT)
+startup_phase("conversation store")
+
+def load_conversations():
+    """One-time import of the old conversations.json into a freshly created store"""
+    if not conversation_history.fresh or not os.path.exists(CONVERSATIONS_FILE):
+        return
+    try:
+        with open(CONVERSATIONS_FILE, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+        imported = [parse_conversation(key, entries) for key, entries in raw.items()]
+        with conversation_history.lock:
+            conversation_history.write_cold(imported)
+            conversation_history.count = len({key for key, _ in imported})
+        print(f"💬 Imported {len(imported)} conversations from {CONVERSATIONS_FILE}")
+    except Exception as e:
+        print(f"⚠️ Could not import conversations: {e}")
+
+def get_conversation(key):
+    if state_backend.shared:
+        stored = state_backend.get(f"conv:{key}")
+        return parse_conversation(key, json.loads(stored))[1] if stored else None
+    return conversation_history.get(key)
+
+def clear_history(key):
+    conversation_history.pop(key)
+    if state_backend.shared:
+        state_backend.delete(f"conv:{key}")
+
+def add_to_history(user_id, chat_id, user_message, bot_response):
+    key = conversation_key(user_id, chat_id)
+    exchange = Exchange(user_message, bot_response, time.time())
+    if state_backend.shared:
+        # A fresh copy parsed from the backend, so no other thread holds it while it changes
+        conversation = get_conversation(key) or Conversation()
+        conversation.add(exchange)
+        conversation_history.put(key, conversation)
+        state_backend.set(f"conv:{key}", json.dumps(conversation.to_json(), ensure_ascii=False),
+                          CONVERSATION_STATE_TTL)
+    else:
+        conversation_history.append(key, exchange)
+    mark_dirty("conv", key)
+
+def get_conversation_context(user_id, chat_id):
+    key = conversation_key(user_id, chat_id)
+    if state_backend.shared:
+        conversation = get_conversation(key)
+        return conversation.render() if conversation else ""
+    return conversation_history.context(key)
 
 # ================== DATA MANAGEMENT ==================
 def load_json(file_path, default_data=None):
@@ -131,29 +885,386 @@ def load_json(file_path, default_data=None):
     return default_data if default_data is not None else {}
 
 def save_json(file_path, data):
+    # Write to a temp file and swap it in so a crash never leaves a half-written snapshot;
+    # the pid keeps workers sharing a directory from renaming each other's temp file
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
         return True
     except Exception as e:
         print(f"❌ Error saving {file_path}: {e}")
         return False
 
-# Load all data
-users_data = load_json(USERS_FILE, {})
-verified_users = load_json(VERIFIED_FILE, [])
-load_conversations()
+# ================== APPEND-ONLY LOG ==================
+# Every mutation is one JSON line appended to DATA_LOG_FILE. The JSON files are
+# snapshots; on startup they are loaded and the log is replayed on top of them.
+# With a shared state backend, users and verification live in the backend
+# instead: the snapshots and log only seed a fresh backend, nothing is appended,
+# and the snapshots become an export that one worker at a time writes.
+LOG_COMPACT_THRESHOLD = int(os.environ.get('LOG_COMPACT_THRESHOLD', 5000))
+SNAPSHOT_LOCK_TTL = 60
+log_lock = threading.RLock()
+log_file = None
+log_entries = 0
+
+def append_log(records):
+    global log_file, log_entries
+    if not records:
+        return True
+    lines = "".join(json.dumps({"k": kind, "id": key, "v": value}, ensure_ascii=False) + "\n"
+                    for kind, key, value in records)
+    with log_lock:
+        try:
+            if log_file is None:
+                log_file = open(DATA_LOG_FILE, 'a', encoding='utf-8')
+            log_file.write(lines)
+            log_file.flush()
+            log_entries += len(records)
+        except Exception as e:
+            print(f"❌ Error appending to {DATA_LOG_FILE}: {e}")
+            return False
+        if log_entries >= LOG_COMPACT_THRESHOLD:
+            compact_log()
+    return True
+
+def apply_log_record(record):
+    kind, key, value = record.get("k"), record.get("id"), record.get("v")
+    if kind == "user":
+        users_data[key] = value
+    elif kind == "verified":
+        user_id = normalize_user_id(key)
+        if user_id is not None:
+            verified_users.add(user_id)
+    elif kind == "unverified":
+        verified_users.discard(normalize_user_id(key))
+    elif kind == "conv":
+        # Logs written before conversations moved to SQLite; fold them into the store
+        key, conversation = parse_conversation(key, value)
+        if conversation.exchanges:
+            conversation_history.put(key, conversation)
+            conversation_history.write_back([key])
+        else:
+            conversation_history.pop(key)
+
+def replay_log():
+    global log_entries
+    if not os.path.exists(DATA_LOG_FILE):
+        return
+    replayed = 0
+    try:
+        with open(DATA_LOG_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    apply_log_record(json.loads(line))
+                except ValueError:
+                    continue  # torn last line from a crash mid-append
+                replayed += 1
+    except Exception as e:
+        print(f"⚠️ Could not replay {DATA_LOG_FILE}: {e}")
+    log_entries = replayed
+    if replayed:
+        print(f"📜 Replayed {replayed} log entries")
+
+def compact_log():
+    """Write fresh snapshots and truncate the log"""
+    global log_file, log_entries
+    if not state_loaded.is_set():
+        return False  # the snapshots on disk are still the only copy
+    started = time.time()
+    with log_lock:
+        if state_backend.shared:
+            if not state_backend.claim("lock:snapshot", SNAPSHOT_LOCK_TTL):
+                return False  # another worker exported the shared state just now
+            users, verified = export_shared_state()
+        else:
+            users, verified = dict(users_data), sorted(verified_users)
+        ok = save_json(USERS_FILE, users)
+        ok = save_json(VERIFIED_FILE, verified) and ok
+        if not ok:
+            return False  # keep the log, it still holds what the snapshots missed
+        if log_file is not None:
+            log_file.close()
+        log_file = open(DATA_LOG_FILE, 'w', encoding='utf-8')
+        log_entries = 0
+    observe("tristin_save_duration_seconds", time.time() - started, kind="snapshot")
+    return True
+
+def normalize_user_id(user_id):
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+def load_verified():
+    # verified.json is a list on disk; older versions wrote a mix of str and int IDs
+    raw = load_json(VERIFIED_FILE, [])
+    verified = {uid for uid in map(normalize_user_id, raw) if uid is not None}
+    if len(verified) != len(raw) or any(not isinstance(uid, int) for uid in raw):
+        print(f"🔧 Migrated {VERIFIED_FILE}: {len(raw)} entries -> {len(verified)} unique IDs")
+        save_json(VERIFIED_FILE, sorted(verified))
+    return verified
+
+# Filled in by load_state() on the warmup thread; nothing is saved until it has run
+users_data = {}
+verified_users = set()
+state_loaded = threading.Event()
+
+def load_state():
+    global users_data, verified_users
+    users_data = load_json(USERS_FILE, {})
+    verified_users = load_verified()
+    load_conversations()
+    replay_log()
+    stats_totals["messages"] = sum(u.get("messages", 0) for u in users_data.values())
+    if state_backend.shared:
+        seed_shared_state()
+    load_lookup_caches()
+    state_loaded.set()
+    print(f"📊 Users: {user_count()} | ✅ Verified: {verified_count()} | 💬 Conversations: {len(conversation_history)}")
+
+def seed_shared_state():
+    """The first worker on a fresh backend copies the snapshots into it; the backend is the only copy from then on"""
+    if state_backend.add("meta", "seeded"):
+        for user_id in verified_users:
+            state_backend.add("verified", str(user_id))
+        for user_id, record in users_data.items():
+            state_backend.add("users", user_id)
+            state_backend.set(f"user:{user_id}:first_seen", record.get("first_seen", ""))
+            state_backend.set(f"user:{user_id}:last_interaction", record.get("last_interaction", ""))
+            state_backend.incr(f"user:{user_id}:messages", record.get("messages", 0))
+        state_backend.incr("stats:messages", stats_totals["messages"])
+        print(f"🌱 Seeded shared state: {len(users_data)} users, {len(verified_users)} verified")
+    users_data.clear()
+    verified_users.clear()
+
+def export_shared_state():
+    users = {user_id: {"messages": int(state_backend.get(f"user:{user_id}:messages") or 0),
+                       "first_seen": state_backend.get(f"user:{user_id}:first_seen"),
+                       "last_interaction": state_backend.get(f"user:{user_id}:last_interaction")}
+             for user_id in state_backend.members("users")}
+    verified = sorted(uid for uid in map(normalize_user_id, state_backend.members("verified")) if uid is not None)
+    return users, verified
+
+# ================== LOOKUP CACHE ==================
+class TTLCache:
+    """Thread-safe LRU cache with per-entry TTL and short-lived negative entries"""
+    
+    def __init__(self, max_size, ttl, negative_ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl if negative_ttl is not None else ttl
+        self.entries = OrderedDict()  # key -> (value, expires_at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+    
+    def set(self, key, value, negative=False):
+        expires_at = time.time() + (self.negative_ttl if negative else self.ttl)
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+    
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
+    
+    def dump(self):
+        now = time.time()
+        with self.lock:
+            return [[list(key) if isinstance(key, tuple) else key, value, expires_at]
+                    for key, (value, expires_at) in self.entries.items() if expires_at > now]
+    
+    def restore(self, items):
+        now = time.time()
+        with self.lock:
+            for key, value, expires_at in items:
+                if expires_at > now:
+                    self.entries[tuple(key) if isinstance(key, list) else key] = (value, expires_at)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+LOOKUP_CACHE_SIZE = int(os.environ.get('LOOKUP_CACHE_SIZE', 5000))
+LOOKUP_CACHE_TTL = int(os.environ.get('LOOKUP_CACHE_TTL', 7 * 86400))
+LOOKUP_NEGATIVE_TTL = int(os.environ.get('LOOKUP_NEGATIVE_TTL', 3600))
+LOOKUP_CACHE_PERSIST = os.environ.get('LOOKUP_CACHE_PERSIST', '1') == '1'
+LOOKUP_CACHE_SAVE_INTERVAL = int(os.environ.get('LOOKUP_CACHE_SAVE_INTERVAL', 300))
+define_cache = TTLCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL, LOOKUP_NEGATIVE_TTL)
+translate_cache = TTLCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL)
+lookup_cache_saved_at = time.time()
+
+def load_lookup_caches():
+    global lookup_cache_saved_at
+    if not LOOKUP_CACHE_PERSIST:
+        return
+    data = load_json(LOOKUP_CACHE_FILE, {})
+    define_cache.restore(data.get("define", []))
+    translate_cache.restore(data.get("translate", []))
+    lookup_cache_saved_at = time.time()
+
+def save_lookup_caches():
+    global lookup_cache_saved_at
+    lookup_cache_saved_at = time.time()
+    if LOOKUP_CACHE_PERSIST:
+        save_json(LOOKUP_CACHE_FILE, {"define": define_cache.dump(), "translate": translate_cache.dump()})
+
+
+# ================== WRITE-BEHIND FLUSHER ==================
+# Handlers only mark records dirty; a single background thread turns the dirty
+# set into one batched log append every FLUSH_INTERVAL seconds (or sooner once
+# FLUSH_BATCH_SIZE records are waiting).
+FLUSH_INTERVAL = float(os.environ.get('FLUSH_INTERVAL', 2))
+FLUSH_BATCH_SIZE = int(os.environ.get('FLUSH_BATCH_SIZE', 200))
+dirty_records = {"user": set(), "verified": set(), "conv": set()}
+dirty_lock = threading.Lock()
+flush_wakeup = threading.Event()
+flush_stats = {"flushes": 0, "records": 0, "last_batch": 0, "last_latency_ms": 0.0, "max_latency_ms": 0.0}
+
+def mark_dirty(kind, key):
+    with dirty_lock:
+        dirty_records[kind].add(key)
+        backlog = sum(len(keys) for keys in dirty_records.values())
+    if backlog >= FLUSH_BATCH_SIZE:
+        flush_wakeup.set()
+
+def dirty_backlog():
+    with dirty_lock:
+        return sum(len(keys) for keys in dirty_records.values())
+
+def flush_dirty():
+    with dirty_lock:
+        pending = {kind: keys for kind, keys in dirty_records.items() if keys}
+        for kind in pending:
+            dirty_records[kind] = set()
+    if not pending:
+        return 0
+    
+    started = time.time()
+    records = []
+    for key in pending.get("user", ()):
+        if key in users_data:
+            records.append(("user", key, dict(users_data[key])))
+    for key in pending.get("verified", ()):
+        records.append(("verified" if key in verified_users else "unverified", key, None))
+    try:
+        written = conversation_history.write_back(pending.get("conv", ()))
+    except Exception as e:
+        print(f"❌ Error writing conversations: {e}")
+        written = None
+    
+    if written is None or not append_log(records):
+        # Put the keys back so the next pass retries them
+        with dirty_lock:
+            for kind, keys in pending.items():
+                dirty_records[kind].update(keys)
+        return 0
+    
+    observe("tristin_save_duration_seconds", time.time() - started, kind="flush")
+    latency_ms = (time.time() - started) * 1000
+    flush_stats["flushes"] += 1
+    flush_stats["records"] += len(records) + written
+    flush_stats["last_batch"] = len(records) + written
+    flush_stats["last_latency_ms"] = round(latency_ms, 2)
+    flush_stats["max_latency_ms"] = round(max(flush_stats["max_latency_ms"], latency_ms), 2)
+    return len(records) + written
+
+def run_flusher():
+    while True:
+        flush_wakeup.wait(FLUSH_INTERVAL)
+        flush_wakeup.clear()
+        try:
+            flush_dirty()
+            conversation_history.write_spilled()
+            conversation_history.evict_idle(CONVERSATION_IDLE_TIMEOUT)
+            if state_loaded.is_set() and time.time() - lookup_cache_saved_at >= LOOKUP_CACHE_SAVE_INTERVAL:
+                save_lookup_caches()
+        except Exception as e:
+            print(f"⚠️ Flusher error: {e}")
+
+flusher_thread = threading.Thread(target=run_flusher, daemon=True)
+flusher_thread.start()
 
 def save_all_data():
-    save_json(USERS_FILE, users_data)
-    save_json(VERIFIED_FILE, verified_users)
-    save_conversations()
-    print("💾 All data saved")
+    if not state_loaded.is_set():
+        return
+    flush_dirty()
+    conversation_history.write_spilled()
+    save_lookup_caches()
+    if compact_log():
+        print("💾 All data saved")
 
 atexit.register(save_all_data)
 
+# ================== STATS ==================
+# Aggregates are maintained as messages arrive so stats reads never scan users_data
+stats_lock = threading.Lock()
+stats_totals = {"messages": 0}  # load_state() seeds this with one scan of users_data
+hourly_messages = deque(maxlen=24)  # [hour number, messages], newest last
+daily_active = {"day": None, "users": set(), "previous_day": 0}
+
+def record_activity(user_id_str):
+    hour = int(time.time() // 3600)
+    with stats_lock:
+        stats_totals["messages"] += 1
+        if not hourly_messages or hourly_messages[-1][0] != hour:
+            hourly_messages.append([hour, 0])
+        hourly_messages[-1][1] += 1
+        day = hour // 24
+        if daily_active["day"] != day:
+            daily_active["previous_day"] = len(daily_active["users"]) if daily_active["day"] == day - 1 else 0
+            daily_active.update(day=day, users=set())
+        daily_active["users"].add(user_id_str)
+
+def get_stats_snapshot():
+    hour = int(time.time() // 3600)
+    with stats_lock:
+        today = daily_active["day"] == hour // 24
+        return {
+            "users": user_count(),
+            "messages": int(state_backend.get("stats:messages") or 0) if state_backend.shared else stats_totals["messages"],
+            "verified": verified_count(),
+            "conversations": len(conversation_history),
+            "active_conversations": len(active_conversations),
+            "dau": len(daily_active["users"]) if today else 0,
+            "dau_yesterday": daily_active["previous_day"] if today else 0,
+            "messages_last_hour": hourly_messages[-1][1] if hourly_messages and hourly_messages[-1][0] == hour else 0,
+            "messages_24h": sum(count for h, count in hourly_messages if h > hour - 24),
+        }
+
 def ensure_user_exists(user_id):
     user_id_str = str(user_id)
+    if state_backend.shared:
+        now = datetime.now().isoformat()
+        if state_backend.add("users", user_id_str):
+            state_backend.set(f"user:{user_id_str}:first_seen", now)
+        state_backend.set(f"user:{user_id_str}:last_interaction", now)
+        state_backend.incr(f"user:{user_id_str}:messages")
+        state_backend.incr("stats:messages")
+        record_activity(user_id_str)
+        return
     if user_id_str not in users_data:
         users_data[user_id_str] = {
             "messages": 0,
@@ -162,61 +1273,622 @@ def ensure_user_exists(user_id):
         }
     users_data[user_id_str]["messages"] += 1
     users_data[user_id_str]["last_interaction"] = datetime.now().isoformat()
+    mark_dirty("user", user_id_str)
+    record_activity(user_id_str)
     return users_data[user_id_str]
 
+# With a shared backend every verification check asks it, except that a "yes"
+# is remembered for VERIFIED_CACHE_TTL seconds; a revocation on another worker
+# takes at most that long to show up here.
+VERIFIED_CACHE_TTL = int(os.environ.get('VERIFIED_CACHE_TTL', 30))
+VERIFIED_CACHE_MAX = int(os.environ.get('VERIFIED_CACHE_MAX', 50000))
+verified_cache = TTLCache(VERIFIED_CACHE_MAX, VERIFIED_CACHE_TTL)
+
+def user_count():
+    return state_backend.count("users") if state_backend.shared else len(users_data)
+
+def verified_count():
+    return state_backend.count("verified") if state_backend.shared else len(verified_users)
+
+def verified_user_ids():
+    if state_backend.shared:
+        return [uid for uid in map(normalize_user_id, state_backend.members("verified")) if uid is not None]
+    return list(verified_users)
+
 def is_user_verified(user_id):
-    return str(user_id) in verified_users
+    user_id = normalize_user_id(user_id)
+    if not state_backend.shared:
+        return user_id in verified_users
+    if user_id is None:
+        return False
+    if verified_cache.get(user_id)[0]:
+        return True
+    if state_backend.contains("verified", str(user_id)):
+        verified_cache.set(user_id, True)
+        return True
+    return False
 
 def verify_user_id(user_id):
-    user_id_str = str(user_id)
-    if user_id_str not in verified_users:
-        verified_users.append(user_id_str)
-        save_json(VERIFIED_FILE, verified_users)
+    user_id = normalize_user_id(user_id)
+    if user_id is None:
+        return False
+    if state_backend.shared:
+        verified_cache.set(user_id, True)
+        return state_backend.add("verified", str(user_id))
+    if user_id not in verified_users:
+        verified_users.add(user_id)
+        mark_dirty("verified", user_id)
         return True
     return False
 
+def unverify_user_id(user_id):
+    user_id = normalize_user_id(user_id)
+    if state_backend.shared:
+        verified_cache.pop(user_id)
+        return user_id is not None and state_backend.remove("verified", str(user_id))
+    if user_id in verified_users:
+        verified_users.discard(user_id)
+        mark_dirty("verified", user_id)
+        return True
+    return False
+
+# ================== EXPIRY SCHEDULER ==================
+# One hashed timing wheel owns every TTL in the process (dedupe, conversation
+# activity, cooldowns) instead of a threading.Timer thread per entry. Inserts
+# are O(1): an entry lands in slot (position + ticks) % WHEEL_SLOTS and waits
+# out `rounds` full turns of the wheel before firing.
+WHEEL_TICK = float(os.environ.get('WHEEL_TICK', 0.25))
+WHEEL_SLOTS = int(os.environ.get('WHEEL_SLOTS', 512))
+timer_wheel = [[] for _ in range(WHEEL_SLOTS)]
+wheel_position = 0
+wheel_pending = 0
+wheel_lock = threading.Lock()
+
+def schedule_expiry(delay, callback, *args):
+    global wheel_pending
+    ticks = max(1, math.ceil(delay / WHEEL_TICK))
+    with wheel_lock:
+        slot = (wheel_position + ticks) % WHEEL_SLOTS
+        timer_wheel[slot].append([(ticks - 1) // WHEEL_SLOTS, callback, args])
+        wheel_pending += 1
+
+def advance_wheel():
+    global wheel_position, wheel_pending
+    with wheel_lock:
+        wheel_position = (wheel_position + 1) % WHEEL_SLOTS
+        bucket = timer_wheel[wheel_position]
+        due = [entry for entry in bucket if entry[0] == 0]
+        if due:
+            timer_wheel[wheel_position] = bucket = [entry for entry in bucket if entry[0] > 0]
+            wheel_pending -= len(due)
+        for entry in bucket:
+            entry[0] -= 1
+    for _, callback, args in due:
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"⚠️ Expiry callback error: {e}")
+
+def run_expiry_scheduler():
+    next_tick = time.time() + WHEEL_TICK
+    while True:
+        delay = next_tick - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        advance_wheel()
+        next_tick += WHEEL_TICK
+
+expiry_thread = threading.Thread(target=run_expiry_scheduler, daemon=True)
+expiry_thread.start()
+
 # ================== ANTI-SPAM ==================
 USER_COOLDOWN = 0.8
-user_last_message = defaultdict(float)
-active_conversations = defaultdict(lambda: {"active": False, "timestamp": 0})
 CONVERSATION_TIMEOUT = 10
-user_message_counts = defaultdict(list)
 SPAM_WINDOW = 8
 SPAM_THRESHOLD = 6
-chat_last_response = defaultdict(float)
 CHAT_COOLDOWN = 0.5
-processed_messages = set()
-PROCESSED_MESSAGE_EXPIRY = 60
+PROCESSED_MESSAGE_EXPIRY = int(os.environ.get('PROCESSED_MESSAGE_EXPIRY', 60))
+PROCESSED_MESSAGE_MAX = int(os.environ.get('PROCESSED_MESSAGE_MAX', 200000))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 50000))
+RATE_LIMIT_SWEEP_INTERVAL = float(os.environ.get('RATE_LIMIT_SWEEP_INTERVAL', 5))
+STATE_PURGE_INTERVAL = float(os.environ.get('STATE_PURGE_INTERVAL', 60))
+
+class BoundedStateMap:
+    """LRU map that drops keys idle for longer than idle_ttl and never holds more than max_keys"""
+    
+    def __init__(self, factory, idle_ttl, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.factory = factory
+        self.idle_ttl = idle_ttl
+        self.max_keys = max_keys
+        self.entries = OrderedDict()  # key -> [value, last_touched], oldest first
+        self.lock = threading.Lock()
+        self.evictions = 0
+    
+    def peek(self, key):
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+    
+    def touch(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [self.factory(), now]
+                if len(self.entries) > self.max_keys:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+            else:
+                entry[1] = now
+                self.entries.move_to_end(key)
+            return entry[0]
+    
+    def sweep(self, now):
+        evicted = 0
+        with self.lock:
+            while self.entries:
+                key, (_, last_touched) = next(iter(self.entries.items()))
+                if now - last_touched < self.idle_ttl:
+                    break
+                self.entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        return evicted
+    
+    def __len__(self):
+        return len(self.entries)
+
+class DedupeWindow:
+    """Set of (chat_id, message_id) seen in the last window seconds, in two rotating generations"""
+    # Message IDs are only unique within a chat, so both halves make the key,
+    # packed into one int; IDs past 32 bits (Telegram doesn't hand those out
+    # today) stay as the pair, which can't collide with a packed key. Lookups
+    # check the current and previous generation; the older one is dropped
+    # wholesale on rotation, so an entry lives between window and 2 * window
+    # seconds. A generation that fills up rotates early, which keeps memory
+    # fixed at max_entries keys under any message rate.
+    
+    def __init__(self, window, max_entries, clock=time.monotonic):
+        self.window = window
+        self.generation_size = max(1, max_entries // 2)
+        self.current = set()
+        self.previous = set()
+        self.clock = clock
+        self.rotated_at = clock()
+        self.lock = threading.Lock()
+        self.rotations = 0
+        self.early_rotations = 0
+    
+    @staticmethod
+    def pack(key):
+        chat_id, message_id = key
+        if 0 <= message_id < 1 << 32:
+            return (int(chat_id) << 32) | message_id
+        return key
+    
+    def rotate(self, now):
+        if now - self.rotated_at >= 2 * self.window:
+            self.previous = set()  # quiet for a whole window: nothing in current is still fresh either
+        else:
+            self.previous = self.current
+        self.current = set()
+        self.rotated_at = now
+        self.rotations += 1
+    
+    def __contains__(self, key):
+        packed = self.pack(key)
+        with self.lock:
+            now = self.clock()
+            if now - self.rotated_at >= self.window:
+                self.rotate(now)
+            return packed in self.current or packed in self.previous
+    
+    def add(self, key):
+        packed = self.pack(key)
+        with self.lock:
+            now = self.clock()
+            if now - self.rotated_at >= self.window:
+                self.rotate(now)
+            elif len(self.current) >= self.generation_size:
+                self.early_rotations += 1
+                self.rotate(now)
+            self.current.add(packed)
+    
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+processed_messages = DedupeWindow(PROCESSED_MESSAGE_EXPIRY, PROCESSED_MESSAGE_MAX)
+
+class UserRateState:
+    __slots__ = ("last_message", "recent")
+    
+    def __init__(self):
+        self.last_message = 0.0
+        # Ring buffer: once it holds SPAM_THRESHOLD + 2 stamps the private-chat limit is already hit
+        self.recent = deque(maxlen=SPAM_THRESHOLD + 2)
+    
+    def count_recent(self, now):
+        while self.recent and now - self.recent[0] >= SPAM_WINDOW:
+            self.recent.popleft()
+        return len(self.recent)
 
-def can_send_response(user_id, chat_id, message_id):
+user_rate_state = BoundedStateMap(UserRateState, max(SPAM_WINDOW, USER_COOLDOWN))
+chat_last_response = BoundedStateMap(lambda: [0.0], CHAT_COOLDOWN)
+active_conversations = BoundedStateMap(dict, CONVERSATION_TIMEOUT)
+spam_stats = {"rejections": defaultdict(int), "sweeps": 0}
+
+def reject_message(reason):
+    spam_stats["rejections"][reason] += 1
+    inc_counter("tristin_spam_dropped_total", reason=reason)
+    return False
+
+def can_send_response(user_id, chat_id, message_id, batched=False):
     now = time.time()
-    if message_id in processed_messages:
-        return False
+    if (chat_id, message_id) in processed_messages:
+        return reject_message("duplicate")
     
+    user_state = user_rate_state.peek(user_id)
     if chat_id > 0:  # Private chat
-        user_message_counts[user_id] = [t for t in user_message_counts[user_id] if now - t < SPAM_WINDOW]
-        if len(user_message_counts[user_id]) >= SPAM_THRESHOLD + 2:
-            return False
+        if user_state and user_state.count_recent(now) >= SPAM_THRESHOLD + 2:
+            return reject_message("user_spam")
     else:  # Group chat
-        if now - user_last_message[user_id] < USER_COOLDOWN:
-            return False
-        user_message_counts[user_id] = [t for t in user_message_counts[user_id] if now - t < SPAM_WINDOW]
-        if len(user_message_counts[user_id]) >= SPAM_THRESHOLD:
-            return False
-        if now - chat_last_response[chat_id] < CHAT_COOLDOWN:
-            return False
+        if user_state and now - user_state.last_message < USER_COOLDOWN:
+            return reject_message("user_cooldown")
+        if user_state and user_state.count_recent(now) >= SPAM_THRESHOLD:
+            return reject_message("user_spam")
+        chat_state = chat_last_response.peek(chat_id)
+        if not batched and chat_state and now - chat_state[0] < CHAT_COOLDOWN:
+            return reject_message("chat_cooldown")
+    return True
+
+def claim_shared_response(user_id, chat_id, message_id, batched=False):
+    # Check-and-mark in one step per key so two workers can't both pass the same limit.
+    # As in memory, the spam window only counts answered messages, and a message
+    # rejected by one limit leaves the others unspent.
+    if not state_backend.claim(f"seen:{chat_id}:{message_id}", PROCESSED_MESSAGE_EXPIRY):
+        return reject_message("duplicate")
+    spam_key = f"spam:{user_id}"
+    if state_backend.recent(spam_key, SPAM_WINDOW) >= (SPAM_THRESHOLD + 2 if chat_id > 0 else SPAM_THRESHOLD):
+        return reject_message("user_spam")
+    if chat_id < 0:
+        if not state_backend.claim(f"cool:user:{user_id}", USER_COOLDOWN):
+            return reject_message("user_cooldown")
+        if not batched and not state_backend.claim(f"cool:chat:{chat_id}", CHAT_COOLDOWN):
+            state_backend.delete(f"cool:user:{user_id}")
+            return reject_message("chat_cooldown")
+    state_backend.hit(spam_key, SPAM_WINDOW)
     return True
 
-def mark_response_sent(user_id, chat_id, message_id):
+def purge_shared_state():
+    try:
+        state_backend.purge(SPAM_WINDOW)
+    except Exception as e:
+        print(f"⚠️ State backend purge failed: {e}")
+    schedule_expiry(STATE_PURGE_INTERVAL, purge_shared_state)
+
+def mark_response_sent(user_id, chat_id, message_id, batched=False):
+    """Record a response about to be sent; False if another worker already claimed it"""
+    # Batched prompts get the chat cooldown from queue_prompt instead, only when they open a call
+    if state_backend.shared and not claim_shared_response(user_id, chat_id, message_id, batched):
+        return False
     now = time.time()
-    user_last_message[user_id] = now
-    chat_last_response[chat_id] = now
-    processed_messages.add(message_id)
-    threading.Timer(PROCESSED_MESSAGE_EXPIRY, lambda: processed_messages.discard(message_id)).start()
+    user_state = user_rate_state.touch(user_id, now)
+    user_state.last_message = now
+    user_state.recent.append(now)
+    if not batched:
+        chat_last_response.touch(chat_id, now)[0] = now
+    processed_messages.add((chat_id, message_id))
     
-    conv_key = f"{user_id}:{chat_id}"
-    active_conversations[conv_key] = {"active": True, "timestamp": now}
-    threading.Timer(CONVERSATION_TIMEOUT, lambda: active_conversations.update({conv_key: {"active": False, "timestamp": now}})).start()
+    active_conversations.touch(f"{user_id}:{chat_id}", now).update({"active": True, "timestamp": now})
+    return True
+
+def sweep_rate_limits():
+    now = time.time()
+    for state_map in (user_rate_state, chat_last_response, active_conversations, typing_sent):
+        state_map.sweep(now)
+    outbound.sweep()
+    spam_stats["sweeps"] += 1
+    schedule_expiry(RATE_LIMIT_SWEEP_INTERVAL, sweep_rate_limits)
+
+def get_rate_limit_stats():
+    return {
+        "tracked_users": len(user_rate_state),
+        "tracked_chats": len(chat_last_response),
+        "active_conversations": len(active_conversations),
+        "evictions": sum(m.evictions for m in (user_rate_state, chat_last_response, active_conversations)),
+        "processed_messages": len(processed_messages),
+        "dedupe_early_rotations": processed_messages.early_rotations,
+        "rejections": dict(spam_stats["rejections"]),
+    }
+
+schedule_expiry(RATE_LIMIT_SWEEP_INTERVAL, sweep_rate_limits)
+schedule_expiry(STATE_PURGE_INTERVAL, purge_shared_state)
+
+# ================== OUTBOUND SENDS ==================
+# Every Telegram call that posts into a chat is a job on the outbound queue.
+# A scheduler thread hands jobs to a small sender pool as soon as both the
+# global token bucket (Telegram allows about 30 messages/s per bot) and the
+# chat's own bucket (about 1/s in private chats, 20/min in groups) have a
+# token. Ready chats are served by priority (replies, then edits, then typing)
+# and each chat has at most one send in flight, so its messages arrive in
+# order. A 429 puts the job back at the front of its chat and pauses that chat
+# for the retry_after Telegram asks for. Typing indicators only spend global
+# tokens, so they never eat into a chat's message budget. Handlers mostly
+# queue a reply and move on (queue_reply); plain bot.* calls that need the
+# returned Message wait on the job's future for at most SEND_WAIT_TIMEOUT; a
+# job still queued by then (first try or a 429 retry) is abandoned and dropped
+# with SendSkipped instead of sent late.
+SEND_GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', 30))
+SEND_PRIVATE_RATE = float(os.environ.get('SEND_PRIVATE_RATE', 1))
+SEND_GROUP_RATE = float(os.environ.get('SEND_GROUP_RATE', 20 / 60))
+SEND_CHAT_BURST = int(os.environ.get('SEND_CHAT_BURST', 3))
+SEND_WORKERS = int(os.environ.get('SEND_WORKERS', 8))
+SEND_WAIT_TIMEOUT = float(os.environ.get('SEND_WAIT_TIMEOUT', 5))
+SEND_MAX_ATTEMPTS = 3
+SEND_MAX_RETRY_AFTER = 30  # longer pauses fail the send rather than hold it that long
+TYPING_INTERVAL = 4.5  # Telegram shows "typing…" for ~5s or until the next message
+PRIORITY_REPLY, PRIORITY_EDIT, PRIORITY_TYPING = 0, 1, 2
+GATED_METHODS = {"sendMessage": PRIORITY_REPLY, "sendPhoto": PRIORITY_REPLY,
+                 "editMessageText": PRIORITY_EDIT, "sendChatAction": PRIORITY_TYPING}
+send_stats = {"sent": 0, "waited": 0, "wait_seconds": 0.0, "retried_429": 0, "failed_429": 0,
+              "failed": 0, "skipped": 0, "typing_coalesced": 0, "typing_stale": 0}
+send_context = threading.local()  # .options from send_options(); .job on sender threads
+
+class SendSkipped(Exception):
+    """The send could not go out at once and the caller asked not to wait"""
+
+class RetryAfter(Exception):
+    def __init__(self, seconds):
+        super().__init__(f"retry after {seconds}s")
+        self.seconds = seconds
+
+@contextlib.contextmanager
+def send_options(wait=True):
+    """Sends in this block raise SendSkipped instead of queueing behind the chat's rate limit (wait=False)"""
+    previous = getattr(send_context, "options", None)
+    send_context.options = wait
+    try:
+        yield
+    finally:
+        send_context.options = previous
+
+class OutboundJob:
+    __slots__ = ("priority", "seq", "fn", "args", "kwargs", "future", "queued_at", "attempts", "stale_if_sent",
+                 "log_errors", "sending", "abandoned")
+
+class SendFuture(Future):
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+
+class ChatOutbox:
+    __slots__ = ("jobs", "rate", "tokens", "updated", "blocked_until", "last_sent", "busy")
+    
+    def __init__(self, rate, now):
+        self.jobs = []  # heap of (priority, seq, job)
+        self.rate = rate
+        self.tokens = float(SEND_CHAT_BURST)
+        self.updated = now
+        self.blocked_until = 0.0
+        self.last_sent = 0.0  # last message or edit; typing doesn't count
+        self.busy = False
+    
+    def delay(self, now, charged=True):
+        """Seconds until this chat may send again (uncharged sends only wait out a 429)"""
+        self.tokens = min(SEND_CHAT_BURST, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        return 0.0 if not charged or self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+def chat_send_rate(chat_id):
+    try:
+        return SEND_PRIVATE_RATE if int(chat_id) > 0 else SEND_GROUP_RATE
+    except ValueError:
+        return SEND_GROUP_RATE  # @channel usernames
+
+class OutboundQueue:
+    def __init__(self, workers):
+        self.cond = threading.Condition()
+        self.outboxes = {}  # chat_id (str) -> ChatOutbox
+        self.ready = set()  # chats with queued jobs and nothing in flight
+        self.global_tokens = SEND_GLOBAL_RATE
+        self.global_updated = time.monotonic()
+        self.next_seq = 0
+        self.queued = 0
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbound")
+        self.scheduler = threading.Thread(target=self.run, name="outbound-scheduler", daemon=True)
+        self.scheduler.start()
+    
+    def submit(self, chat_id, priority, fn, args=(), kwargs=None, stale_if_sent=False, log_errors=False, wait=True):
+        job = OutboundJob()
+        job.priority, job.fn, job.args, job.kwargs = priority, fn, args, kwargs or {}
+        job.future = SendFuture(job)
+        job.queued_at = time.monotonic()
+        job.attempts = 0
+        job.stale_if_sent = stale_if_sent  # drop it if the chat gets a message before this goes out
+        job.log_errors = log_errors
+        job.sending = False  # a request for it is on the wire right now
+        job.abandoned = False
+        with self.cond:
+            box = self.outboxes.get(chat_id)
+            if box is None:
+                box = self.outboxes[chat_id] = ChatOutbox(chat_send_rate(chat_id), job.queued_at)
+            if not wait and (box.busy or box.jobs or box.delay(job.queued_at, priority != PRIORITY_TYPING) > 0
+                             or self.global_tokens < 1):
+                send_stats["skipped"] += 1
+                raise SendSkipped()
+            job.seq = self.next_seq
+            self.next_seq += 1
+            heapq.heappush(box.jobs, (priority, job.seq, job))
+            self.queued += 1
+            if not box.busy:
+                self.ready.add(chat_id)
+            self.cond.notify_all()
+        return job.future
+    
+    def run(self):
+        with self.cond:
+            while True:
+                self.cond.wait(self.dispatch_ready())
+    
+    def dispatch_ready(self):
+        """Start every job that may go now, best first; return seconds until the next one might"""
+        now = time.monotonic()
+        self.global_tokens = min(SEND_GLOBAL_RATE, self.global_tokens + (now - self.global_updated) * SEND_GLOBAL_RATE)
+        self.global_updated = now
+        next_wait = 1.0
+        candidates = []
+        for chat_id in self.ready:
+            box = self.outboxes[chat_id]
+            delay = box.delay(now, box.jobs[0][0] != PRIORITY_TYPING)
+            if delay > 0:
+                next_wait = min(next_wait, delay)
+            else:
+                candidates.append((box.jobs[0][0], box.jobs[0][1], chat_id))
+        candidates.sort()
+        for _, _, chat_id in candidates:
+            if self.global_tokens < 1:
+                return min(next_wait, (1 - self.global_tokens) / SEND_GLOBAL_RATE)
+            box = self.outboxes[chat_id]
+            _, _, job = heapq.heappop(box.jobs)
+            self.queued -= 1
+            stale = not job.abandoned and job.stale_if_sent and box.last_sent > job.queued_at
+            if job.abandoned or stale:  # abandoned: its caller gave up waiting and already got SendSkipped
+                if stale:
+                    send_stats["typing_stale"] += 1
+                    job.future.set_result(None)
+                if not box.jobs:
+                    self.ready.discard(chat_id)
+                next_wait = 0  # the next job in this chat may be ready right away
+                continue
+            self.global_tokens -= 1
+            if job.priority != PRIORITY_TYPING:
+                box.tokens -= 1
+                box.last_sent = now
+            box.busy = True
+            job.sending = True
+            self.ready.discard(chat_id)
+            waited = now - job.queued_at
+            send_stats["sent"] += 1
+            if waited > 0.01:
+                send_stats["waited"] += 1
+                send_stats["wait_seconds"] += waited
+            try:
+                self.pool.submit(self.execute, chat_id, box, job)
+            except RuntimeError as e:  # interpreter shutting down
+                job.sending = False
+                job.future.set_exception(e)
+                return 1.0
+        return next_wait
+    
+    def execute(self, chat_id, box, job):
+        job.attempts += 1
+        send_context.job = job
+        try:
+            result = job.fn(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            send_stats["retried_429"] += 1
+            with self.cond:
+                box.blocked_until = max(box.blocked_until, time.monotonic() + e.seconds)
+                heapq.heappush(box.jobs, (job.priority, job.seq, job))  # same seq: back at the front of its chat
+                self.queued += 1
+        except Exception as e:
+            send_stats["failed"] += 1
+            if job.log_errors:
+                print(f"⚠️ Send to chat {chat_id} failed: {e}")
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+        finally:
+            send_context.job = None
+            with self.cond:
+                job.sending = False
+                box.busy = False
+                if box.jobs:
+                    self.ready.add(chat_id)
+                self.cond.notify_all()
+    
+    def abandon(self, future):
+        """Give up on a job unless a request for it is on the wire; True if it will never be sent"""
+        with self.cond:
+            job = future.job
+            if job.sending or future.done():
+                return False
+            job.abandoned = True
+            future.set_exception(SendSkipped())
+            return True
+    
+    def sweep(self, idle_seconds=60):
+        """Forget chats that have nothing queued and have been quiet long enough to have a full bucket"""
+        now = time.monotonic()
+        with self.cond:
+            for chat_id in [c for c, box in self.outboxes.items()
+                            if not box.jobs and not box.busy and now - box.updated >= idle_seconds and box.blocked_until <= now]:
+                del self.outboxes[chat_id]
+
+outbound = OutboundQueue(SEND_WORKERS)
+
+def retry_after_of(response):
+    try:
+        return float(response.json().get("parameters", {}).get("retry_after", 1))
+    except ValueError:
+        return 1.0
+
+def wait_sent(future):
+    """The send's result; SendSkipped if it is still queued after SEND_WAIT_TIMEOUT"""
+    timeout = SEND_WAIT_TIMEOUT
+    while True:
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            if outbound.abandon(future):
+                send_stats["skipped"] += 1
+                raise SendSkipped()
+            # A request is on the wire: it either finishes the job or puts it back for a 429 retry
+            timeout = 0.1
+
+def send_gated(priority, chat_id, method, url, kwargs):
+    job = getattr(send_context, "job", None)
+    if job is None:
+        # Called straight from a handler: queue it and wait (bounded) for our turn
+        wait = getattr(send_context, "options", None)
+        return wait_sent(outbound.submit(chat_id, priority, send_telegram_request, (method, url), kwargs,
+                                         wait=wait is not False))
+    r = http_request("telegram", method, url, retry=False, **kwargs)
+    if r.status_code == 429:
+        retry_after = retry_after_of(r)
+        if job.attempts < SEND_MAX_ATTEMPTS and retry_after <= SEND_MAX_RETRY_AFTER:
+            raise RetryAfter(retry_after)
+        send_stats["failed_429"] += 1
+        print(f"⚠️ Telegram 429 for chat {chat_id} (retry_after={retry_after}s), giving up")
+    return r
+
+def queue_reply(message, text, **kwargs):
+    """bot.reply_to without waiting for it to go out; failures are logged"""
+    return outbound.submit(str(message.chat.id), PRIORITY_REPLY, bot.reply_to, (message, text), kwargs, log_errors=True)
+
+def queue_message(chat_id, text, **kwargs):
+    """bot.send_message without waiting for it to go out; failures are logged"""
+    return outbound.submit(str(chat_id), PRIORITY_REPLY, bot.send_message, (chat_id, text), kwargs, log_errors=True)
+
+# Typing indicators are queued behind replies, sent at most once per chat every
+# TYPING_INTERVAL, and dropped if the reply they announce went out first.
+typing_sent = BoundedStateMap(lambda: [0.0], TYPING_INTERVAL)
+typing_lock = threading.Lock()
+
+def send_typing(chat_id):
+    now = time.time()
+    with typing_lock:
+        last = typing_sent.touch(chat_id, now)
+        if now - last[0] < TYPING_INTERVAL:
+            send_stats["typing_coalesced"] += 1
+            return None
+        last[0] = now
+    return outbound.submit(str(chat_id), PRIORITY_TYPING, bot.send_chat_action, (chat_id, 'typing'),
+                           stale_if_sent=True, log_errors=True)
+
+def get_send_stats():
+    return {**send_stats, "wait_seconds": round(send_stats["wait_seconds"], 2),
+            "queued": outbound.queued, "tracked_chats": len(outbound.outboxes)}
 
 # ================== COMMON ACRONYMS ==================
 COMMON_ACRONYMS = {
@@ -234,14 +1906,6 @@ COMMON_ACRONYMS = {
     'tf': 'the fuck', 'wth': 'what the hell', 'tfw': 'that feeling when'
 }
 
-def expand_acronyms(text):
-    words = text.split()
-    expanded = []
-    for word in words:
-        clean = ''.join(c for c in word.lower() if c.isalnum())
-        expanded.append(COMMON_ACRONYMS.get(clean, word))
-    return ' '.join(expanded)
-
 # ================== COMMON GREETINGS ==================
 COMMON_GREETINGS = {
     'hi': ["Hey! 👋", "Hi there! 😊", "Hello! 👀", "Hiiii 👋"],
@@ -264,18 +1928,89 @@ COMMON_GREETINGS = {
     'assemble': ["Power Rangers? More like Power Nappers 😴", "Assembling my thoughts... give me a sec 💭"]
 }
 
-def get_common_response(message):
-    msg = message.lower().strip()
-    if msg in COMMON_GREETINGS:
-        return random.choice(COMMON_GREETINGS[msg])
-    words = msg.split()
-    for word in words:
-        if word in COMMON_GREETINGS:
-            return random.choice(COMMON_GREETINGS[word])
+# ================== PHRASE MATCHER ==================
+# Acronyms and greetings are compiled into one token trie. A single pass over the
+# message expands acronyms and tracks every partial greeting match, so
+# multi-word greetings ("how are you", "thank you") are found anywhere in the
+# text, not only when they are the whole message.
+PHRASES_FILE = os.environ.get('PHRASES_FILE', 'phrases.json')
+PHRASE_END = None  # trie key marking "a phrase ends here"
+CLEAN_TOKEN = re.compile(r"[\W_]+")
+acronym_table = {}
+greeting_trie = {}
+
+def clean_token(word):
+    return CLEAN_TOKEN.sub('', word.lower())
+
+def load_phrases():
+    # Optional {"acronyms": {...}, "greetings": {...}} file that extends/overrides the built-ins
+    data = load_json(PHRASES_FILE, {})
+    COMMON_ACRONYMS.update(data.get("acronyms", {}))
+    COMMON_GREETINGS.update(data.get("greetings", {}))
+    if data:
+        print(f"🗂 Loaded phrases from {PHRASES_FILE}")
+
+def compile_phrases():
+    global acronym_table, greeting_trie
+    table = {}
+    for acronym, expansion in COMMON_ACRONYMS.items():
+        table[clean_token(acronym)] = (expansion, [clean_token(w) for w in expansion.split()])
+    trie = {}
+    for phrase in COMMON_GREETINGS:
+        node = trie
+        for token in phrase.split():
+            node = node.setdefault(clean_token(token), {})
+        node[PHRASE_END] = phrase
+    acronym_table, greeting_trie = table, trie
+
+def match_phrases(text):
+    """Return (acronym-expanded text, first greeting phrase found or None)"""
+    expanded = []
+    active = []  # (start position, trie node) for greetings still being matched
+    best = None  # (start position, phrase); the earliest start wins, then the longest phrase
+    position = 0
+    for word in text.split():
+        clean = clean_token(word)
+        acronym = acronym_table.get(clean)
+        if acronym:
+            expanded.append(acronym[0])
+            tokens = acronym[1]
+        else:
+            expanded.append(word)
+            tokens = (clean,)
+        for token in tokens:
+            if active:
+                still_active = []
+                for start, node in active:
+                    child = node.get(token)
+                    if child is None or (best and start > best[0]):
+                        continue
+                    still_active.append((start, child))
+                    phrase = child.get(PHRASE_END)
+                    if phrase and (best is None or start <= best[0]):
+                        best = (start, phrase)  # same start but ends later means longer
+                active = still_active
+            if best is None:
+                child = greeting_trie.get(token)
+                if child is not None:
+                    active.append((position, child))
+                    if PHRASE_END in child:
+                        best = (position, child[PHRASE_END])
+            position += 1
+    return ' '.join(expanded), best[1] if best else None
+
+def get_common_response(greeting, expanded):
+    if greeting:
+        return random.choice(COMMON_GREETINGS[greeting])
+    msg = expanded.lower()
     if 'ranger' in msg or 'assemble' in msg:
         return random.choice(COMMON_GREETINGS.get('rangers', ["What's good? 🤔"]))
     return None
 
+load_phrases()
+compile_phrases()
+startup_phase("phrase matcher")
+
 # ================== KEYBOARDS ==================
 def get_verification_keyboard():
     markup = types.InlineKeyboardMarkup()
@@ -301,19 +2036,77 @@ def safe_edit_message(chat_id, msg_id, text, markup=None):
     try:
         bot.edit_message_text(text, chat_id, msg_id, parse_mode="HTML", reply_markup=markup)
         return True
-    except:
+    except SendSkipped:
+        return False
+    except apihelper.ApiTelegramException as e:
+        if "message is not modified" not in e.description:
+            print(f"⚠️ Edit failed in chat {chat_id}: {e.description}")
+        return False
+    except requests.RequestException as e:
+        print(f"⚠️ Edit failed in chat {chat_id}: {e}")
         return False
 
-def check_channel_membership(user_id, channel):
+# ================== CHANNEL MEMBERSHIP ==================
+MEMBERSHIP_WORKERS = int(os.environ.get('MEMBERSHIP_WORKERS', 8))
+MEMBERSHIP_TTL = int(os.environ.get('MEMBERSHIP_TTL', 600))
+MEMBERSHIP_NEGATIVE_TTL = int(os.environ.get('MEMBERSHIP_NEGATIVE_TTL', 15))
+MEMBERSHIP_CACHE_MAX = int(os.environ.get('MEMBERSHIP_CACHE_MAX', 50000))
+REVERIFY_INTERVAL = int(os.environ.get('REVERIFY_INTERVAL', 0))  # seconds, 0 = disabled
+REVERIFY_BATCH = int(os.environ.get('REVERIFY_BATCH', 25))
+REVERIFY_PAUSE = float(os.environ.get('REVERIFY_PAUSE', 2))
+REVERIFY_WORKERS = int(os.environ.get('REVERIFY_WORKERS', 2))
+membership_pool = ThreadPoolExecutor(max_workers=MEMBERSHIP_WORKERS, thread_name_prefix="membership")
+# Background re-checks get their own small pool so verify clicks never queue behind them
+reverify_pool = ThreadPoolExecutor(max_workers=REVERIFY_WORKERS, thread_name_prefix="reverify")
+membership_cache = TTLCache(MEMBERSHIP_CACHE_MAX, MEMBERSHIP_TTL, MEMBERSHIP_NEGATIVE_TTL)  # (user_id, channel) -> is_member
+
+def check_channel_membership(user_id, channel, use_cache=True):
+    """use_cache=False is the background re-check: it neither reads nor fills the verify-click cache"""
+    key = (normalize_user_id(user_id), channel)
+    if use_cache:
+        hit, is_member = membership_cache.get(key)
+        if hit:
+            return is_member
     try:
         clean = channel.replace('@', '')
         member = bot.get_chat_member(clean, user_id)
-        return member.status in ['member', 'administrator', 'creator']
+        is_member = member.status in ['member', 'administrator', 'creator']
     except:
-        return False
+        return None  # unknown: treated as missing by callers, never cached
+    
+    if use_cache:
+        membership_cache.set(key, is_member, negative=not is_member)
+    elif not is_member:
+        membership_cache.pop(key)  # a leaver's cached "member" must not re-verify them on the next click
+    return is_member
+
+def get_missing_channels(user_id, use_cache=True):
+    futures = [(ch, membership_pool.submit(check_channel_membership, user_id, ch, use_cache)) for ch in CHANNELS]
+    return [ch for ch, future in futures if not future.result()]
+
+def run_reverification():
+    """Periodically re-check verified users in small batches and revoke leavers"""
+    while True:
+        time.sleep(REVERIFY_INTERVAL)
+        revoked = 0
+        user_ids = verified_user_ids()
+        for i in range(0, len(user_ids), REVERIFY_BATCH):
+            batch = user_ids[i:i + REVERIFY_BATCH]
+            futures = [(uid, [reverify_pool.submit(check_channel_membership, uid, ch, False) for ch in CHANNELS])
+                       for uid in batch]
+            for uid, checks in futures:
+                # Only a definite "not a member" revokes; API errors leave the user alone
+                if any(f.result() is False for f in checks) and unverify_user_id(uid):
+                    revoked += 1
+            time.sleep(REVERIFY_PAUSE)
+        print(f"🔁 Re-verified {len(user_ids)} users, revoked {revoked}")
+
+if REVERIFY_INTERVAL > 0:
+    threading.Thread(target=run_reverification, daemon=True).start()
 
 # ================== VERIFICATION ==================
 @bot.callback_query_handler(func=lambda call: call.data == 'verify')
+@timed
 def handle_verification(call):
     uid = str(call.from_user.id)
     if is_user_verified(uid):
@@ -322,7 +2115,7 @@ def handle_verification(call):
                          "<b>You're already verified!</b>\n\nWhat now? 👇", get_main_menu_keyboard())
         return
     
-    missing = [f"@{ch}" for ch in CHANNELS if not check_channel_membership(uid, ch)]
+    missing = [f"@{ch}" for ch in get_missing_channels(uid)]
     if missing:
         bot.answer_callback_query(call.id, f"Missing {len(missing)} channel(s)!")
         channel_list = "\n".join([f"• {ch}" for ch in missing])
@@ -337,64 +2130,73 @@ def handle_verification(call):
 
 # ================== COMMAND HANDLERS ==================
 @bot.message_handler(commands=['start', 'help', 'menu'])
+@timed
 def handle_start(message):
     uid = message.from_user.id
     ensure_user_exists(uid)
     
     if not is_user_verified(uid):
         channel_list = "\n".join([f"• @{ch}" for ch in CHANNELS])
-        bot.send_message(message.chat.id,
+        queue_message(message.chat.id,
                         f"👋 <b>Hey {message.from_user.first_name}!</b>\n\nJoin ALL my channels then click verify:\n\n{channel_list}",
                         parse_mode="HTML", reply_markup=get_verification_keyboard())
     else:
-        bot.send_message(message.chat.id,
+        queue_message(message.chat.id,
                         f"Oh, it's you... 👀\n\n<b>Miss Tristin here. 20. American.</b>\nWhat do you want? 👇",
                         parse_mode="HTML", reply_markup=get_main_menu_keyboard())
 
 @bot.message_handler(commands=['clear'])
+@timed
 def handle_clear(message):
     if not is_user_verified(message.from_user.id):
         return
-    uid = str(message.from_user.id)
-    if uid in conversation_history:
-        conversation_history[uid] = []
-        save_conversations()
-        bot.reply_to(message, "🧹 Memory cleared!")
+    key = conversation_key(message.from_user.id, message.chat.id)
+    if get_conversation(key):
+        clear_history(key)
+        queue_reply(message, "🧹 Memory cleared!")
     else:
-        bot.reply_to(message, "Nothing to clear 😏")
+        queue_reply(message, "Nothing to clear 😏")
 
 # ================== CALLBACK HANDLERS ==================
 @bot.callback_query_handler(func=lambda call: call.data == 'back_to_menu')
+@timed
 def back_to_menu(call):
     bot.answer_callback_query(call.id, "Back to menu")
     safe_edit_message(call.message.chat.id, call.message.message_id,
                      "<b>Back so soon?</b>\n\nWhat now? 👇", get_main_menu_keyboard())
 
 @bot.callback_query_handler(func=lambda call: call.data == 'help')
+@timed
 def help_callback(call):
     help_text = ("<b>🔥 HELP</b>\n\n<b>Commands:</b>\n• define [word]\n• translate en fr [text]\n"
                 "• rock/paper/scissors\n• /clear - Clear memory\n\n<b>Chat:</b>\n• @mention me\n"
-                "• Reply to me\n• Say 'Tristin'\n• Private message\n\n<i>I remember our last 5 messages 💭</i>")
+                f"• Reply to me\n• Say 'Tristin'\n• Private message\n\n<i>I remember our last {MAX_HISTORY_PER_USER} messages 💭</i>")
     safe_edit_message(call.message.chat.id, call.message.message_id, help_text, get_back_button())
 
 @bot.callback_query_handler(func=lambda call: call.data == 'about')
+@timed
 def about_callback(call):
     about_text = f"<b>😎 ABOUT</b>\n\nCreators: {DEV1_USERNAME} & {DEV2_USERNAME}\n\n<i>Built to entertain, coded to sass 💅</i>"
     safe_edit_message(call.message.chat.id, call.message.message_id, about_text, get_back_button())
 
 @bot.callback_query_handler(func=lambda call: call.data == 'rps')
+@timed
 def rps_callback(call):
     text = "<b>✂️ ROCK PAPER SCISSORS</b>\n\nJust send: rock, paper, or scissors\n\n<i>I'll go easy... maybe 😏</i>"
     safe_edit_message(call.message.chat.id, call.message.message_id, text, get_back_button())
 
 @bot.callback_query_handler(func=lambda call: call.data == 'stats')
+@timed
 def stats_callback(call):
-    stats_text = (f"<b>📊 STATS</b>\n\nUsers: {len(users_data)}\n"
-                 f"Messages: {sum(u.get('messages',0) for u in users_data.values())}\n"
-                 f"Verified: {len(verified_users)}\nConversations: {len(conversation_history)}")
+    stats = get_stats_snapshot()
+    stats_text = (f"<b>📊 STATS</b>\n\nUsers: {stats['users']}\n"
+                 f"Messages: {stats['messages']}\n"
+                 f"Verified: {stats['verified']}\nConversations: {stats['conversations']}\n"
+                 f"Active today: {stats['dau']}")
     safe_edit_message(call.message.chat.id, call.message.message_id, stats_text, get_back_button())
 
 @bot.callback_query_handler(func=lambda call: call.data == 'uptime')
+@timed
 def uptime_callback(call):
     seconds = int(time.time() - START_TIME)
     days, rem = divmod(seconds, 86400)
@@ -403,21 +2205,94 @@ def uptime_callback(call):
     safe_edit_message(call.message.chat.id, call.message.message_id,
                      f"<b>⏱ UPTIME</b>\n\n{uptime}", get_back_button())
 
+# ================== MESSAGE ROUTING ==================
+# Each text message is lowercased once, then matched against the command
+# prefixes and a single precompiled mention/name-trigger alternation. Filters and handlers read
+# the cached MessageRoute instead of re-lowering and re-scanning the text.
+NAME_TRIGGERS = ['miss tristin', 'tristin', 'derieri']  # longest first so "miss tristin" goes as a whole
+RPS_CHOICES = frozenset(['rock', 'paper', 'scissors'])
+COMMAND_PREFIXES = ('define ', 'translate ')
+TRIGGER_PATTERN = None
+TRIGGER_LITERALS = []
+
+def compile_triggers(username):
+    """Build the trigger regex; the @mention part is added once the bot's username is known"""
+    global TRIGGER_PATTERN, TRIGGER_LITERALS
+    mention = f"@{username.lower()}" if username else None
+    alternatives = [f"(?P<name>{'|'.join(map(re.escape, NAME_TRIGGERS))})"]
+    if mention:
+        alternatives.insert(0, f"(?P<mention>{re.escape(mention)})")
+    TRIGGER_PATTERN = re.compile("|".join(alternatives))
+    # Python's re has no literal prefilter for alternations, so a cheap substring test
+    # on the minimal set of literals (any trigger contains one of them) gates the regex
+    TRIGGER_LITERALS = [t for t in ([mention] if mention else []) + NAME_TRIGGERS
+                        if not any(other != t and other in t for other in NAME_TRIGGERS)]
+
+compile_triggers(BOT_USERNAME)
+# mention_text / name_text hold the message with that trigger cut out, or None if absent
+MessageRoute = namedtuple("MessageRoute", "kind lowered arg mention_text name_text")
+# Shared by every message that is not for us, so the common case allocates nothing;
+# handle_chat only reads its trigger fields
+NOT_FOR_US = MessageRoute("chat", None, None, None, None)
+
+def cut_spans(text, spans):
+    parts, last = [], 0
+    for start, end in spans:
+        parts.append(text[last:start])
+        last = end
+    parts.append(text[last:])
+    return " ".join("".join(parts).split())
+
+def parse_route(text):
+    lowered = text.lower()
+    if lowered.startswith('/'):
+        return MessageRoute("command", lowered, text, None, None)
+    if lowered in RPS_CHOICES:
+        return MessageRoute("rps", lowered, text, None, None)
+    if lowered.startswith(COMMAND_PREFIXES):
+        kind, _, _ = lowered.partition(' ')
+        return MessageRoute(kind, lowered, text[len(kind) + 1:], None, None)
+    for literal in TRIGGER_LITERALS:
+        if literal in lowered:
+            break
+    else:
+        return NOT_FOR_US  # the common case
+    
+    # Spans found in the lowercased copy only line up with the original if lowering kept the length
+    source = text if len(lowered) == len(text) else lowered
+    spans = {"mention": [], "name": []}
+    for trigger in TRIGGER_PATTERN.finditer(lowered):
+        spans[trigger.lastgroup].append(trigger.span())
+    return MessageRoute("chat", lowered, text,
+                        cut_spans(source, spans["mention"]) if spans["mention"] else None,
+                        cut_spans(source, spans["name"]) if spans["name"] else None)
+
+def route_message(message):
+    route = getattr(message, 'route', None)
+    if route is None:
+        route = message.route = parse_route(message.text or "")
+    return route
+
+def is_route(kind):
+    # Called for every text message by each filter in turn, so the cached route is read inline
+    return lambda m: (getattr(m, 'route', None) or route_message(m)).kind == kind
+
 # ================== GAME HANDLER ==================
-@bot.message_handler(func=lambda m: m.text and m.text.lower() in ['rock', 'paper', 'scissors'])
+@bot.message_handler(func=is_route('rps'))
+@timed
 def handle_rps(message):
-    if not is_user_verified(message.from_user.id) or message.message_id in processed_messages:
+    if not is_user_verified(message.from_user.id) or (message.chat.id, message.message_id) in processed_messages:
         return
     if not can_send_response(message.from_user.id, message.chat.id, message.message_id):
         return
     
-    mark_response_sent(message.from_user.id, message.chat.id, message.message_id)
+    if not mark_response_sent(message.from_user.id, message.chat.id, message.message_id):
+        return
     
     # 🔥 TYPING EFFECT
-    bot.send_chat_action(message.chat.id, 'typing')
-    time.sleep(0.3)  # Small delay for effect
+    send_typing(message.chat.id)
     
-    user = message.text.lower()
+    user = route_message(message).lowered
     bot_choice = random.choice(['rock', 'paper', 'scissors'])
     
     if user == bot_choice:
@@ -430,83 +2305,203 @@ def handle_rps(message):
         result, react = "I win! 😌", "🎉"
     
     reply = f"<b>✂️ RPS</b>\n\nYou: {user}\nMe: {bot_choice}\n\n{result} {react}"
-    bot.reply_to(message, reply, parse_mode="HTML")
-    add_to_history(message.from_user.id, f"played {user}", reply)
+    queue_reply(message, reply, parse_mode="HTML")
+    add_to_history(message.from_user.id, message.chat.id, f"played {user}", reply)
 
 # ================== DEFINE HANDLER ==================
-@bot.message_handler(func=lambda m: m.text and m.text.lower().startswith('define '))
+def lookup_definition(word):
+    key = word.lower().strip()
+    hit, definition = define_cache.get(key)
+    if hit:
+        return definition
+    
+    r = http_request("dictionary", "GET", f'{DICTIONARY_API_URL}{key}')
+    if r.status_code == 200:
+        data = r.json()
+        definition = data[0]['meanings'][0]['definitions'][0]['definition']
+        define_cache.set(key, definition)
+        return definition
+    if r.status_code == 404:
+        define_cache.set(key, None, negative=True)  # unknown word
+    return None
+
+@bot.message_handler(func=is_route('define'))
+@timed
 def handle_define(message):
-    if not is_user_verified(message.from_user.id) or message.message_id in processed_messages:
+    if not is_user_verified(message.from_user.id) or (message.chat.id, message.message_id) in processed_messages:
         return
     if not can_send_response(message.from_user.id, message.chat.id, message.message_id):
         return
     
     try:
-        word = message.text.split(' ', 1)[1].strip()
+        word = route_message(message).arg.strip()
         if not word:
-            bot.reply_to(message, "Define what? 🙄")
+            queue_reply(message, "Define what? 🙄")
             return
         
-        mark_response_sent(message.from_user.id, message.chat.id, message.message_id)
+        if not mark_response_sent(message.from_user.id, message.chat.id, message.message_id):
+            return
         
         # 🔥 TYPING EFFECT
-        bot.send_chat_action(message.chat.id, 'typing')
-        
-        r = requests.get(f'https://api.dictionaryapi.dev/api/v2/entries/en/{word}', timeout=10)
+        send_typing(message.chat.id)
         
-        if r.status_code == 200:
-            data = r.json()
-            definition = data[0]['meanings'][0]['definitions'][0]['definition']
+        definition = lookup_definition(word)
+        if definition:
             reply = f"<b>📖 {word.upper()}</b>\n\n{definition}"
-            bot.reply_to(message, reply, parse_mode="HTML")
-            add_to_history(message.from_user.id, f"define {word}", reply)
+            queue_reply(message, reply, parse_mode="HTML")
+            add_to_history(message.from_user.id, message.chat.id, f"define {word}", reply)
         else:
             reply = f"'{word}'? Never heard of it. 🙄"
-            bot.reply_to(message, reply)
-            add_to_history(message.from_user.id, f"define {word}", reply)
+            queue_reply(message, reply)
+            add_to_history(message.from_user.id, message.chat.id, f"define {word}", reply)
     except Exception as e:
         print(f"Define error: {e}")
-        bot.reply_to(message, "That word doesn't exist... or reality. 😏")
+        queue_reply(message, "That word doesn't exist... or reality. 😏")
 
 # ================== TRANSLATE HANDLER ==================
-@bot.message_handler(func=lambda m: m.text and m.text.lower().startswith('translate '))
+def translate_text(from_lang, to_lang, text):
+    key = (from_lang, to_lang, " ".join(text.split()))
+    hit, translated = translate_cache.get(key)
+    if hit:
+        return translated
+    from bs4 import BeautifulSoup  # installed with deep-translator; only the first /translate pays for it
+    from deep_translator.constants import GOOGLE_LANGUAGES_TO_CODES
+    codes = GOOGLE_LANGUAGES_TO_CODES.values()
+    if from_lang not in codes or to_lang not in codes:
+        raise ValueError(f"unsupported languages {from_lang} -> {to_lang}")
+    if from_lang == to_lang:
+        return text.strip()
+    # The request deep_translator's GoogleTranslator makes, sent through http_request
+    # so the translator breaker's timeout applies to the socket itself
+    r = http_request("translator", "GET", TRANSLATOR_URL, params={"sl": from_lang, "tl": to_lang, "q": text.strip()})
+    if r.status_code != 200:
+        raise requests.HTTPError(f"translator returned {r.status_code}", response=r)
+    soup = BeautifulSoup(r.text, "html.parser")
+    # Same selectors as GoogleTranslator in deep_translator 1.11.x; update them together
+    element = soup.find("div", {"class": "t0"}) or soup.find("div", {"class": "result-container"})
+    if not element:
+        raise ValueError("no translation in the translator's response")
+    translated = element.get_text(strip=True)
+    if translated:
+        translate_cache.set(key, translated)
+    return translated
+
+@bot.message_handler(func=is_route('translate'))
+@timed
 def handle_translate(message):
-    if not is_user_verified(message.from_user.id) or message.message_id in processed_messages:
+    if not is_user_verified(message.from_user.id) or (message.chat.id, message.message_id) in processed_messages:
         return
     if not can_send_response(message.from_user.id, message.chat.id, message.message_id):
         return
     
     try:
-        parts = message.text.split(' ', 3)
-        if len(parts) < 4:
-            bot.reply_to(message, "Use: translate en fr Hello")
+        parts = route_message(message).arg.split(' ', 2)
+        if len(parts) < 3:
+            queue_reply(message, "Use: translate en fr Hello")
             return
         
-        _, from_lang, to_lang, text = parts
+        from_lang, to_lang, text = parts
         from_lang, to_lang = from_lang[:2].lower(), to_lang[:2].lower()
         
         if not text.strip():
             return
         
-        mark_response_sent(message.from_user.id, message.chat.id, message.message_id)
+        if not mark_response_sent(message.from_user.id, message.chat.id, message.message_id):
+            return
         
         # 🔥 TYPING EFFECT
-        bot.send_chat_action(message.chat.id, 'typing')
+        send_typing(message.chat.id)
         
-        translated = GoogleTranslator(source=from_lang, target=to_lang).translate(text)
+        translated = translate_text(from_lang, to_lang, text)
         reply = f"<b>🌍 TRANSLATION</b>\n\n{translated}"
-        bot.reply_to(message, reply, parse_mode="HTML")
-        add_to_history(message.from_user.id, f"translate {text[:30]}...", reply)
+        queue_reply(message, reply, parse_mode="HTML")
+        add_to_history(message.from_user.id, message.chat.id, f"translate {text[:30]}...", reply)
     except Exception as e:
         print(f"Translate error: {e}")
-        bot.reply_to(message, "Translation failed 😒")
+        queue_reply(message, "Translation failed 😒")
 
 # ================== AI HANDLER ==================
-def ask_groq(prompt, user_id=None):
+# With GROQ_STREAMING on, the completion is read as server-sent events: the
+# reply is posted once STREAM_FIRST_CHARS have arrived and then edited in place
+# at most once per STREAM_EDIT_INTERVAL, which keeps well inside Telegram's
+# edit limits for a single chat.
+STREAM_FIRST_CHARS = int(os.environ.get('STREAM_FIRST_CHARS', 20))
+STREAM_EDIT_INTERVAL = float(os.environ.get('STREAM_EDIT_INTERVAL', 1.0))
+
+def stream_groq(headers, payload, on_delta):
+    """Read a streamed completion, passing the text so far to on_delta after every chunk"""
+    started = time.time()
+    r = http_request("groq", "POST", GROQ_API_URL, headers=headers, json={**payload, "stream": True}, stream=True)
+    with r:
+        if r.status_code != 200:
+            print(f"Groq API error: {r.status_code}")
+            return None
+        parts = []
+        try:
+            for line in r.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    if not parts:
+                        observe("tristin_llm_first_token_seconds", time.time() - started)
+                    parts.append(delta)
+                    on_delta("".join(parts))
+        except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+            print(f"Groq stream interrupted: {e}")  # keep whatever arrived before the break
+    return "".join(parts).strip() or None
+
+class StreamingReply:
+    """One Telegram message that follows a reply as it is generated"""
+    
+    def __init__(self, msg_obj):
+        self.msg_obj = msg_obj
+        self.first = None  # future of the first reply, queued without waiting for it
+        self.message = None
+        self.shown = ""
+        self.last_edit = 0.0
+    
+    def update(self, text):
+        text = text.strip()
+        if self.first is None:
+            if len(text) >= STREAM_FIRST_CHARS:
+                self.first = queue_reply(self.msg_obj, text)
+                self.shown, self.last_edit = text, time.time()
+        elif self.posted() and text != self.shown and time.time() - self.last_edit >= STREAM_EDIT_INTERVAL:
+            with send_options(wait=False):  # skip this edit rather than stall the stream on the chat's send budget
+                self.edit(text)
+    
+    def posted(self):
+        """True once the first reply has gone out; edits wait for it"""
+        if self.message is None and self.first.done() and not self.first.cancelled() and not self.first.exception():
+            self.message = self.first.result()
+        return self.message is not None
+    
+    def edit(self, text):
+        edited = safe_edit_message(self.message.chat.id, self.message.message_id, html.escape(text, quote=False))
+        if edited:
+            self.shown = text
+        self.last_edit = time.time()
+        return edited
+    
+    def finish(self, text):
+        """Put the final text in place; False if it couldn't be and the caller should reply"""
+        if self.first is None:
+            return False
+        try:
+            self.message = wait_sent(self.first)
+        except Exception:  # never went out (queue_reply logged why)
+            return False
+        return text == self.shown or self.edit(text)
+
+def ask_groq(prompt, user_id=None, chat_id=None, on_delta=None, max_chars=200):
     if not GROQ_KEY or GROQ_KEY == "your_groq_api_key_here":
         return None
     
-    context = get_conversation_context(user_id) if user_id else ""
+    context = get_conversation_context(user_id, chat_id) if user_id else ""
     
     system_prompt = (
         "You are Miss Tristin, a 20-year-old American girl. "
@@ -518,45 +2513,91 @@ def ask_groq(prompt, user_id=None):
     messages = [{"role": "system", "content": system_prompt}]
     if context:
         messages.append({"role": "system", "content": f"Recent conversation:\n{context}"})
-    messages.append({"role": "user", "content": prompt[:200]})
+    messages.append({"role": "user", "content": prompt[:max_chars]})
+    headers = {"Authorization": f"Bearer {GROQ_KEY}", "Content-Type": "application/json"}
+    payload = {"model": "llama-3.1-8b-instant", "messages": messages, "temperature": 0.8, "max_tokens": 100}
     
     try:
-        r = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers={"Authorization": f"Bearer {GROQ_KEY}", "Content-Type": "application/json"},
-            json={"model": "llama-3.1-8b-instant", "messages": messages, "temperature": 0.8, "max_tokens": 100},
-            timeout=12
-        )
+        if on_delta:
+            return stream_groq(headers, payload, on_delta)
+        r = http_request("groq", "POST", GROQ_API_URL, headers=headers, json=payload)
         if r.status_code == 200:
             return r.json()["choices"][0]["message"]["content"].strip()
         else:
             print(f"Groq API error: {r.status_code}")
+    except CircuitOpen:
+        pass  # Groq is failing; the caller's fallback reply goes out right away
     except Exception as e:
         print(f"Groq API exception: {e}")
     return None
 
+# ================== REPLY CACHE ==================
+# Short repeated chatter ("yo what's up", "you there?") is answered from a small
+# pool of earlier LLM replies for the same normalized prompt. Only prompts from
+# conversations with no history are cached, and Groq is asked without any
+# context for them, so a cached reply never carries what one user said into
+# another user's chat. A key only serves from cache once it has
+# REPLY_CACHE_VARIANTS replies, so answers still vary.
+REPLY_CACHE_SIZE = int(os.environ.get('REPLY_CACHE_SIZE', 2000))
+REPLY_CACHE_TTL = int(os.environ.get('REPLY_CACHE_TTL', 1800))
+REPLY_CACHE_VARIANTS = int(os.environ.get('REPLY_CACHE_VARIANTS', 4))
+REPLY_CACHE_MAX_WORDS = int(os.environ.get('REPLY_CACHE_MAX_WORDS', 6))
+reply_cache = TTLCache(REPLY_CACHE_SIZE, REPLY_CACHE_TTL)
+ai_stats = {"llm_calls": 0, "llm_calls_saved": 0, "llm_failures": 0}
+
+def normalize_prompt(text):
+    text = re.sub(r"['’]", "", text.lower())  # "what's" and "whats" share a key
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+def ask_groq_cached(prompt, user_id=None, chat_id=None, on_delta=None):
+    normalized = normalize_prompt(prompt)
+    cacheable = 0 < len(normalized.split()) <= REPLY_CACHE_MAX_WORDS and \
+        not (user_id and get_conversation_context(user_id, chat_id))
+    if cacheable:
+        hit, variants = reply_cache.get(normalized)
+        if hit and len(variants) >= REPLY_CACHE_VARIANTS:
+            ai_stats["llm_calls_saved"] += 1
+            return random.choice(variants)
+    
+    ai_stats["llm_calls"] += 1
+    if cacheable:
+        reply = ask_groq(prompt, on_delta=on_delta)  # no history, so the reply is safe to share
+    else:
+        reply = ask_groq(prompt, user_id, chat_id, on_delta)
+    if not reply:
+        ai_stats["llm_failures"] += 1
+    elif cacheable:
+        variants = list(variants) if hit else []
+        if reply not in variants:
+            reply_cache.set(normalized, (variants + [reply])[-REPLY_CACHE_VARIANTS:])
+    return reply
+
+def get_ai_stats():
+    return {**ai_stats, "reply_cache": reply_cache.stats(), "coalescing": dict(coalesce_stats)}
+
 def process_ai_request(user_msg, user_id, first_name, chat_id, msg_obj, is_mention=False):
     if not user_msg or len(user_msg.strip()) == 0:
         if is_mention:
             reply = f"Yeah? 👀"
-            bot.reply_to(msg_obj, reply)
-            add_to_history(user_id, "[empty mention]", reply)
+            queue_reply(msg_obj, reply)
+            add_to_history(user_id, chat_id, "[empty mention]", reply)
         return
     
-    expanded = expand_acronyms(user_msg)
+    expanded, greeting = match_phrases(user_msg)
     
     # Check common responses
-    common = get_common_response(expanded)
+    common = get_common_response(greeting, expanded)
     if common:
-        bot.reply_to(msg_obj, common)
-        add_to_history(user_id, user_msg, common)
+        queue_reply(msg_obj, common)
+        add_to_history(user_id, chat_id, user_msg, common)
         return
     
     # 🔥 TYPING EFFECT - Show "typing..." while generating response
-    bot.send_chat_action(chat_id, 'typing')
+    send_typing(chat_id)
     
     # Try Groq
-    reply = ask_groq(expanded, user_id)
+    stream = StreamingReply(msg_obj) if GROQ_STREAMING else None
+    reply = ask_groq_cached(expanded, user_id, chat_id, stream.update if stream else None)
     
     if not reply:
         if is_mention:
@@ -567,17 +2608,117 @@ def process_ai_request(user_msg, user_id, first_name, chat_id, msg_obj, is_menti
                         f"Yeah? 💁‍♀️", f"Uh huh... 💅", f"idk, what's good? 🤔"]
         reply = random.choice(fallbacks)
     
-    bot.reply_to(msg_obj, reply)
-    add_to_history(user_id, user_msg, reply)
+    if not (stream and stream.finish(reply)):
+        queue_reply(msg_obj, reply)
+    add_to_history(user_id, chat_id, user_msg, reply)
+
+# ================== PROMPT COALESCING ==================
+# In groups, a prompt for a chat with no LLM call in flight is answered at
+# once on coalesce_pool, after passing the chat cooldown. Prompts that arrive
+# while that call is running join the batch collecting behind it and are
+# answered together by one LLM call that replies to the last of them, as soon
+# as the current call finishes. Join-vs-open is decided under coalesce_lock,
+# so a prompt can't skip the cooldown by racing the call it meant to join.
+COALESCE_PROMPTS = os.environ.get('COALESCE_PROMPTS', '1') != '0'  # 0 answers every prompt on its own
+COALESCE_MAX_PROMPTS = int(os.environ.get('COALESCE_MAX_PROMPTS', 5))
+COALESCE_WORKERS = int(os.environ.get('COALESCE_WORKERS', 8))
+COALESCE_PROMPT_CHARS = 80  # per prompt inside a combined request
+coalesce_pool = ThreadPoolExecutor(max_workers=COALESCE_WORKERS, thread_name_prefix="coalesce")
+coalesce_lock = threading.Lock()
+open_batches = {}  # chat_id -> PromptBatch collecting behind the call in flight
+busy_chats = set()  # chats with an LLM call on coalesce_pool
+coalesce_stats = {"batches": 0, "prompts_coalesced": 0, "prompts_dropped": 0}
+
+class PromptBatch:
+    __slots__ = ("prompts",)
+    
+    def __init__(self):
+        self.prompts = []  # process_ai_request argument tuples, oldest first
+
+def needs_llm(user_msg):
+    """False for prompts answered without Groq (empty mentions, canned greetings/acronyms)"""
+    if not user_msg or not user_msg.strip():
+        return False
+    expanded, greeting = match_phrases(user_msg)
+    return not get_common_response(greeting, expanded)
+
+def claim_chat_cooldown(chat_id):
+    """Check and start the group's response cooldown in one step (caller holds coalesce_lock)"""
+    now = time.time()
+    chat_state = chat_last_response.peek(chat_id)
+    if chat_state and now - chat_state[0] < CHAT_COOLDOWN:
+        return reject_message("chat_cooldown")
+    if state_backend.shared and not state_backend.claim(f"cool:chat:{chat_id}", CHAT_COOLDOWN):
+        return reject_message("chat_cooldown")
+    chat_last_response.touch(chat_id, now)[0] = now
+    return True
+
+def queue_prompt(user_msg, user_id, first_name, chat_id, msg_obj, is_mention):
+    prompt = (user_msg, user_id, first_name, chat_id, msg_obj, is_mention)
+    with coalesce_lock:
+        if chat_id in busy_chats:
+            batch = open_batches.setdefault(chat_id, PromptBatch())
+            if len(batch.prompts) >= COALESCE_MAX_PROMPTS:
+                coalesce_stats["prompts_dropped"] += 1
+            else:
+                batch.prompts.append(prompt)
+            return
+        if not claim_chat_cooldown(chat_id):
+            return
+        busy_chats.add(chat_id)
+        batch = PromptBatch()
+        batch.prompts.append(prompt)
+    coalesce_pool.submit(run_batches, chat_id, batch)
+
+def run_batches(chat_id, batch):
+    while batch:
+        try:
+            answer_batch(batch.prompts)
+        except Exception as e:
+            print(f"⚠️ Batch error: {e}")
+        with coalesce_lock:
+            batch = open_batches.pop(chat_id, None)
+            if batch:
+                now = time.time()
+                chat_last_response.touch(chat_id, now)[0] = now
+            else:
+                busy_chats.discard(chat_id)
+
+def answer_batch(prompts):
+    coalesce_stats["batches"] += 1
+    if len(prompts) == 1:
+        process_ai_request(*prompts[0])
+        return
+    
+    coalesce_stats["prompts_coalesced"] += len(prompts) - 1
+    _, user_id, _, chat_id, msg_obj, _ = prompts[-1]
+    lines = "\n".join(f"{first_name}: {user_msg.strip()[:COALESCE_PROMPT_CHARS] or '(just called your name)'}"
+                      for user_msg, _, first_name, _, _, _ in prompts)
+    combined = f"A few people in the group are talking to you at once. Answer all of them in one reply:\n{lines}"
+    
+    send_typing(chat_id)
+    stream = StreamingReply(msg_obj) if GROQ_STREAMING else None
+    ai_stats["llm_calls"] += 1
+    reply = ask_groq(combined, user_id, chat_id, stream.update if stream else None, max_chars=len(combined))
+    if not reply:
+        ai_stats["llm_failures"] += 1
+        reply = random.choice([f"One at a time 😏", f"Y'all are loud today 💅", f"Hmm? 👀", f"I'm listening... 💁‍♀️"])
+    
+    if not (stream and stream.finish(reply)):
+        queue_reply(msg_obj, reply)
+    for user_msg, user_id, _, chat_id, _, _ in prompts:
+        add_to_history(user_id, chat_id, user_msg, reply)
 
 # ================== CHAT HANDLER ==================
 @bot.message_handler(func=lambda m: True, content_types=['text'])
+@timed
 def handle_chat(message):
-    if message.text.startswith('/'):
+    route = route_message(message)
+    if route.kind == 'command':
         return
     if not is_user_verified(message.from_user.id):
         return
-    if message.message_id in processed_messages:
+    if (message.chat.id, message.message_id) in processed_messages:
         return
     
     ensure_user_exists(message.from_user.id)
@@ -591,50 +2732,56 @@ def handle_chat(message):
         should_respond = True
         is_mention = True
     # @mention
-    elif f"@{BOT_USERNAME}".lower() in message.text.lower():
+    elif route.mention_text is not None:
         should_respond = True
         is_mention = True
-        clean_msg = re.sub(re.escape(f"@{BOT_USERNAME}"), '', message.text, flags=re.IGNORECASE).strip()
+        clean_msg = route.mention_text
     # Reply to bot
     elif message.reply_to_message and message.reply_to_message.from_user:
         if message.reply_to_message.from_user.id == bot_info.id:
             should_respond = True
             is_mention = True
     # Name triggers
-    elif any(t in message.text.lower() for t in ['tristin', 'derieri', 'miss tristin']):
+    elif route.name_text is not None:
         should_respond = True
         is_mention = True
-        clean_msg = message.text
-        for t in ['tristin', 'derieri', 'miss tristin']:
-            clean_msg = re.sub(re.escape(t), '', clean_msg, flags=re.IGNORECASE).strip()
+        clean_msg = route.name_text
     
     if not should_respond:
         return
-    if not can_send_response(message.from_user.id, message.chat.id, message.message_id):
+    batching = COALESCE_PROMPTS and message.chat.type != 'private' and needs_llm(clean_msg)
+    if not can_send_response(message.from_user.id, message.chat.id, message.message_id, batched=batching):
         return
     
-    mark_response_sent(message.from_user.id, message.chat.id, message.message_id)
-    process_ai_request(clean_msg, message.from_user.id, message.from_user.first_name,
-                      message.chat.id, message, is_mention)
+    if not mark_response_sent(message.from_user.id, message.chat.id, message.message_id, batched=batching):
+        return
+    if batching:
+        queue_prompt(clean_msg, message.from_user.id, message.from_user.first_name,
+                     message.chat.id, message, is_mention)
+    else:
+        process_ai_request(clean_msg, message.from_user.id, message.from_user.first_name,
+                          message.chat.id, message, is_mention)
 
 # ================== UNSUPPORTED CONTENT ==================
 @bot.message_handler(content_types=['audio', 'document', 'photo', 'sticker', 'video', 'voice', 'location', 'contact'])
+@timed
 def handle_unsupported(message):
-    if not is_user_verified(message.from_user.id) or message.message_id in processed_messages:
+    if not is_user_verified(message.from_user.id) or (message.chat.id, message.message_id) in processed_messages:
         return
-    if can_send_response(message.from_user.id, message.chat.id, message.message_id):
-        mark_response_sent(message.from_user.id, message.chat.id, message.message_id)
+    if can_send_response(message.from_user.id, message.chat.id, message.message_id) and \
+       mark_response_sent(message.from_user.id, message.chat.id, message.message_id):
         
         # 🔥 TYPING EFFECT
-        bot.send_chat_action(message.chat.id, 'typing')
-        time.sleep(0.2)
+        send_typing(message.chat.id)
         
         roasts = [f"Text only, {message.from_user.first_name}. 😏",
                  f"Use your words... I know you have them. 😌",
                  f"Nice try. Now type something. 😑"]
         reply = random.choice(roasts)
-        bot.reply_to(message, reply)
-        add_to_history(message.from_user.id, "[non-text]", reply)
+        queue_reply(message, reply)
+        add_to_history(message.from_user.id, message.chat.id, "[non-text]", reply)
+
+startup_phase("handlers")
 
 # ================== FLASK SERVER ==================
 app = Flask(__name__)
@@ -648,25 +2795,152 @@ def home():
     uptime = f"{days}d {hours}h {minutes}m" if days > 0 else f"{hours}h {minutes}m"
     
     return jsonify({
-        'status': 'alive',
+        'status': 'alive' if bot_ready.is_set() else 'warming_up',
         'bot': 'Miss Tristin 💅',
-        'username': f"@{BOT_USERNAME}",
+        'username': f"@{BOT_USERNAME}" if BOT_USERNAME else None,
         'uptime': uptime,
-        'users': len(users_data),
-        'verified': len(verified_users),
-        'conversations': len(conversation_history)
+        'startup_ms': startup_phases,
+        **get_stats_snapshot(),
+        'persistence': {**flush_stats, 'backlog': dirty_backlog(), 'conversations': conversation_history.stats()},
+        'rate_limits': get_rate_limit_stats(),
+        'dispatch': get_dispatch_stats(),
+        'upstreams': get_upstream_stats(),
+        'breakers': get_breaker_stats(),
+        'outbound': get_send_stats(),
+        'caches': {'define': define_cache.stats(), 'translate': translate_cache.stats()},
+        'ai': get_ai_stats()
     })
 
+@app.route('/metrics')
+def metrics():
+    caches = {'define': define_cache, 'translate': translate_cache, 'reply': reply_cache}
+    gauges = {
+        'tristin_dispatch_queue_depth': [({'shard': i}, q.qsize()) for i, q in enumerate(dispatch_queues)],
+        'tristin_flush_backlog': [({}, dirty_backlog())],
+        'tristin_expiry_pending': [({}, wheel_pending)],
+        'tristin_telegram_sends_queued': [({}, outbound.queued)],
+        'tristin_breaker_open': [({'upstream': name}, int(b.state != "closed")) for name, b in breakers.items()],
+        'tristin_breaker_timeout_seconds': [({'upstream': name}, round(b.timeout(), 3)) for name, b in breakers.items()],
+        'tristin_cache_entries': [({'cache': name}, len(c.entries)) for name, c in caches.items()],
+        'tristin_users': [({}, user_count())],
+        'tristin_verified_users': [({}, verified_count())],
+        'tristin_conversations': [({'tier': 'hot'}, len(conversation_history.hot)), ({'tier': 'stored'}, len(conversation_history))],
+        'tristin_uptime_seconds': [({}, int(time.time() - START_TIME))],
+    }
+    counters = {
+        'tristin_dispatch_updates_total': [({'result': k}, v) for k, v in dispatch_stats.items()],
+        'tristin_cache_hits_total': [({'cache': name}, c.hits) for name, c in caches.items()],
+        'tristin_cache_misses_total': [({'cache': name}, c.misses) for name, c in caches.items()],
+        'tristin_llm_calls_total': [({'result': k}, v) for k, v in ai_stats.items()],
+        'tristin_rate_limit_evictions_total': [({}, get_rate_limit_stats()['evictions'])],
+        'tristin_conversation_page_ins_total': [({}, conversation_history.page_ins)],
+        'tristin_conversation_spills_total': [({}, conversation_history.spills)],
+        'tristin_llm_prompts_coalesced_total': [({}, coalesce_stats["prompts_coalesced"])],
+        'tristin_telegram_sends_total': [({'result': k}, v) for k, v in send_stats.items() if k != 'wait_seconds'],
+        'tristin_telegram_send_wait_seconds_total': [({}, round(send_stats["wait_seconds"], 3))],
+        'tristin_breaker_trips_total': [({'upstream': name}, b.trips) for name, b in breakers.items()],
+        'tristin_breaker_rejected_total': [({'upstream': name}, b.rejected) for name, b in breakers.items()],
+    }
+    return render_metrics(gauges, counters), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route('/ping')
 def ping():
     return jsonify({'pong': True, 'timestamp': time.time()})
 
+# ================== UPDATE DISPATCHER ==================
+# Updates are sharded by chat onto a fixed pool of workers, so one slow upstream
+# only stalls the chats on its shard and messages within a chat stay in order.
+# When a shard is full the poller blocks until it drains (backpressure on
+# getUpdates); the offset only moves past updates that were queued, so Telegram
+# keeps anything we have not taken yet. The webhook never blocks: it answers
+# 503 and Telegram redelivers.
+DISPATCH_WORKERS = int(os.environ.get('DISPATCH_WORKERS', 8))
+DISPATCH_QUEUE_SIZE = int(os.environ.get('DISPATCH_QUEUE_SIZE', 100))
+dispatch_queues = [queue.Queue(maxsize=DISPATCH_QUEUE_SIZE) for _ in range(DISPATCH_WORKERS)]
+dispatch_stats = {"enqueued": 0, "processed": 0, "dropped": 0, "errors": 0}
+
+def get_update_chat_id(update):
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    return update.update_id
+
+def dispatch_updates(updates, block=True):
+    for update in updates:
+        shard = dispatch_queues[get_update_chat_id(update) % DISPATCH_WORKERS]
+        try:
+            shard.put(update, block=block)
+        except queue.Full:
+            dispatch_stats["dropped"] += 1
+            print(f"⚠️ Dispatch queue full, refused update {update.update_id}")
+            return False
+        bot.last_update_id = max(bot.last_update_id, update.update_id)
+        dispatch_stats["enqueued"] += 1
+    return True
+
+def run_dispatch_worker(shard):
+    while True:
+        update = shard.get()
+        try:
+            TeleBot.process_new_updates(bot, [update])
+        except Exception as e:
+            dispatch_stats["errors"] += 1
+            print(f"⚠️ Handler error: {e}")
+        dispatch_stats["processed"] += 1
+
+def get_dispatch_stats():
+    return {**dispatch_stats, "queued": sum(q.qsize() for q in dispatch_queues), "workers": DISPATCH_WORKERS}
+
+bot.process_new_updates = dispatch_updates
+for shard in dispatch_queues:
+    threading.Thread(target=run_dispatch_worker, args=(shard,), daemon=True).start()
+
+# ================== WEBHOOK ==================
+# With WEBHOOK_URL set, Telegram POSTs updates here instead of us long-polling,
+# so any number of gunicorn workers can serve them without fighting over
+# getUpdates. Updates are queued and acknowledged right away; a full queue
+# answers 503 so Telegram redelivers later.
+WEBHOOK_PATH = "/telegram/webhook"
+# Every worker must agree on the secret, so the default is derived from the token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TOKEN.encode()).hexdigest()[:64]
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40))
+
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not WEBHOOK_URL or not hmac.compare_digest(secret, WEBHOOK_SECRET):
+        return jsonify({'ok': False}), 403
+    if not bot_ready.is_set():
+        return jsonify({'ok': False}), 503  # Telegram redelivers once we are warmed up
+    try:
+        update = types.Update.de_json(request.get_data(as_text=True))
+    except Exception as e:
+        print(f"⚠️ Bad webhook payload: {e}")
+        return jsonify({'ok': False}), 400
+    if not dispatch_updates([update], block=False):
+        return jsonify({'ok': False}), 503
+    return jsonify({'ok': True})
+
+def register_webhook():
+    url = WEBHOOK_URL + WEBHOOK_PATH
+    try:
+        # Always set it: getWebhookInfo doesn't return the secret, so a changed WEBHOOK_SECRET
+        # (or token) would otherwise leave Telegram sending the old one. The call is idempotent.
+        bot.set_webhook(url=url, secret_token=WEBHOOK_SECRET, max_connections=WEBHOOK_MAX_CONNECTIONS)
+        print(f"🪝 Webhook registered: {url}")
+    except Exception as e:
+        print(f"❌ Could not register webhook: {e}")
+
 # ================== RUN BOT ==================
 def run_bot_polling():
     """Run bot polling with auto-reconnect"""
     while True:
         try:
             print("🚀 Bot polling started...")
+            bot.remove_webhook()  # getUpdates is refused while a webhook is set
             bot.polling(non_stop=True, timeout=60, long_polling_timeout=60)
         except Exception as e:
             print(f"⚠️ Bot crashed: {e}")
@@ -674,37 +2948,63 @@ def run_bot_polling():
             time.sleep(5)
             continue
 
-# 🔥 FIX: START BOT THREAD IMMEDIATELY, NOT INSIDE __main__ check
-print("🚀 Starting bot polling thread...")
-bot_thread = threading.Thread(target=run_bot_polling, daemon=True)
-bot_thread.start()
-print("✅ Bot polling thread started!")
+# ================== WARMUP ==================
+# Importing the module only wires up routes, handlers and worker threads, so the
+# health endpoints answer as soon as the process is up. Loading state, the
+# getMe check and starting polling (or registering the webhook) all happen on
+# this thread; updates are not accepted until bot_ready is set.
+bot_ready = threading.Event()
 
-# ================== FLASK SERVER ==================
-app = Flask(__name__)
+def authenticate():
+    global bot_info, BOT_USERNAME
+    attempt = 0
+    while True:
+        try:
+            bot_info = bot.get_me()
+            BOT_USERNAME = bot_info.username
+            print(f"✅ Bot authenticated: @{BOT_USERNAME}")
+            return
+        except apihelper.ApiTelegramException as e:
+            if e.error_code in (401, 404):
+                print(f"❌ Invalid bot token: {e}")
+                os._exit(1)
+            print(f"⚠️ getMe failed: {e}")
+        except Exception as e:
+            print(f"⚠️ getMe failed: {e}")
+        time.sleep(backoff_delay(min(attempt, 5)))
+        attempt += 1
 
-# ... your Flask routes ...
+def warm_up():
+    clock = [time.perf_counter()]
+    load_state()
+    startup_phase("load state", clock)
+    authenticate()
+    compile_triggers(BOT_USERNAME)
+    startup_phase("authenticate", clock)
+    bot_ready.set()
+    report_startup_profile("ready")
+    if WEBHOOK_URL:
+        register_webhook()
+    else:
+        run_bot_polling()  # this thread becomes the polling thread
+
+warmup_thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+warmup_thread.start()
+startup_phase("flask and dispatch")
+report_startup_profile("import")
 
 # 🔥 FIX: Only run Flask directly when executing locally
 if __name__ == '__main__':
     # This runs ONLY when you do `python app.py` locally
     print("\n" + "="*50)
     print("🔥 MISS TRISTIN IS AWAKE 🔥")
-    print(f"🤖 @{BOT_USERNAME}")
     print(f"🌍 Render: {IS_RENDER}")
-    print("="*50)
-    print(f"📊 Users: {len(users_data)}")
-    print(f"✅ Verified: {len(verified_users)}")
-    print(f"💬 Conversations: {len(conversation_history)}")
     print("="*50 + "\n")
-
-    save_all_data()
     
     # Start Flask server locally
     print(f"🌐 Starting Flask server on port {PORT}...")
     app.run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
 else:
     # 🔥 This runs on Render when Gunicorn imports your app
-    print("🌍 Running on Render - Bot thread already started above")
-    save_all_data()  # Save data on Render startup too
+    print("🌍 Running on Render - " + ("webhook mode" if WEBHOOK_URL else "polling") + ", warming up in the background")
 
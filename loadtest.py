@@ -0,0 +1,632 @@
+"""Load test for app.py against local stand-ins for Telegram, Groq, the dictionary and the translator.
+
+    python loadtest.py --rate 20 --duration 30 --chats 20 --users 200
+    python loadtest.py --stream --groq-latency 1.5 --json results.json
+    python loadtest.py --bot-env COALESCE_PROMPTS=0 --bot-env DISPATCH_WORKERS=16
+    python loadtest.py --workers 4 --rate 80
+    python loadtest.py --worker-sweep --rate 80 --duration 20
+
+The bot runs as a child process (`python app.py`) in a scratch directory with
+every upstream URL pointed at servers started here. Synthetic group and private
+chat traffic is fed to it through getUpdates at the target rate; each reply is
+matched to the update that caused it. Traffic, upstream latencies and injected
+errors all come from seeded RNGs, so two runs with the same arguments send the
+same messages and see the same upstream behaviour.
+
+With --workers N (or --webhook) the bot runs in webhook mode instead: N
+processes share one scratch directory and a SQLite STATE_BACKEND, like
+gunicorn workers would, and updates are POSTed to them round-robin as a load
+balancer would. --worker-sweep repeats the run with 1, 2, 4 and 8 workers and
+prints a throughput table.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+UPSTREAMS = ("telegram", "groq", "dictionary", "translator")
+WEBHOOK_SECRET = "loadtest"
+SWEEP_WORKERS = (1, 2, 4, 8)
+
+# ================== FAKE UPSTREAMS ==================
+class FakeUpstream(BaseHTTPRequestHandler):
+    """Base handler: seeded latency/error injection, keep-alive responses"""
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+    calls = 0
+    errors = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def read_params(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length).decode("utf-8")
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params.update(json.loads(body))
+            else:
+                params.update({k: v[0] for k, v in parse_qs(body).items()})
+        return params
+
+    def draw(self):
+        """Latency to simulate and whether this call fails"""
+        cls = type(self)
+        with cls.rng_lock:
+            cls.calls += 1
+            delay = max(0.0, cls.rng.gauss(cls.latency, cls.jitter)) if cls.jitter else cls.latency
+            failed = cls.rng.random() < cls.error_rate
+            if failed:
+                cls.errors += 1
+        return delay, failed
+
+    def send_body(self, status, body, content_type="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class FakeTelegram(FakeUpstream):
+    updates = deque()
+    updates_cond = threading.Condition()
+    next_update_id = 1
+    next_message_id = 1_000_000
+    on_method = None  # callback(method, params, received_at) set by the harness
+
+    @classmethod
+    def inject(cls, update):
+        with cls.updates_cond:
+            update["update_id"] = cls.next_update_id
+            cls.next_update_id += 1
+            cls.updates.append(update)
+            cls.updates_cond.notify_all()
+
+    def respond(self):
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        params = self.read_params()
+        if method == "getUpdates":
+            self.send_body(200, {"ok": True, "result": self.poll(params)})
+            return
+
+        received_at = time.time()
+        delay, failed = self.draw()
+        time.sleep(delay)
+        if failed:
+            self.send_body(500, {"ok": False, "error_code": 500, "description": "Internal Server Error"})
+            return
+        if type(self).on_method:
+            type(self).on_method(method, params, received_at)
+        self.send_body(200, {"ok": True, "result": self.result_for(method, params)})
+
+    def poll(self, params):
+        offset = int(params.get("offset") or 0)
+        deadline = time.time() + min(float(params.get("timeout") or 0), 5)
+        cls = type(self)
+        with cls.updates_cond:
+            while cls.updates and cls.updates[0]["update_id"] < offset:
+                cls.updates.popleft()  # acknowledged by the new offset
+            while not cls.updates and time.time() < deadline:
+                cls.updates_cond.wait(deadline - time.time())
+            return list(cls.updates)[:int(params.get("limit") or 100)]
+
+    def result_for(self, method, params):
+        cls = type(self)
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Miss Tristin", "username": "tristin_load_bot"}
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "x"}}
+        if method in ("sendMessage", "editMessageText"):
+            with cls.rng_lock:
+                cls.next_message_id += 1
+                message_id = cls.next_message_id
+            chat_id = int(params.get("chat_id") or 0)
+            return {"message_id": message_id, "date": int(time.time()), "text": params.get("text", ""),
+                    "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Miss Tristin"}}
+        return True
+
+class FakeGroq(FakeUpstream):
+    tokens = ["Oh ", "please, ", "you ", "again? ", "That's ", "so ", "cute "]
+    endings = ["😏", "🙄", "💅", "😌", "lol", "ugh."]
+
+    def respond(self):
+        body = self.read_params()
+        delay, failed = self.draw()
+        with FakeGroq.rng_lock:
+            # Like a real model, practically never the same reply twice
+            tokens = self.tokens + [f"{FakeGroq.rng.randrange(1000)}/10 ", FakeGroq.rng.choice(self.endings)]
+        if failed:
+            time.sleep(delay)
+            self.send_body(503, {"error": {"message": "over capacity"}})
+            return
+        if not body.get("stream"):
+            time.sleep(delay)
+            self.send_body(200, {"choices": [{"message": {"role": "assistant", "content": "".join(tokens)}}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            time.sleep(delay / len(tokens))
+            self.write_chunk(f"data: {json.dumps({'choices': [{'delta': {'content': token}}]})}\n\n")
+        self.write_chunk("data: [DONE]\n\n")
+        self.write_chunk("")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+class FakeDictionary(FakeUpstream):
+    def respond(self):
+        word = urlparse(self.path).path.rsplit("/", 1)[-1]
+        delay, failed = self.draw()
+        time.sleep(delay)
+        if failed:
+            self.send_body(503, {"message": "unavailable"})
+        elif word.startswith("zz"):
+            self.send_body(404, {"title": "No Definitions Found"})
+        else:
+            self.send_body(200, [{"word": word, "meanings": [{"definitions": [{"definition": f"A {word}, obviously."}]}]}])
+
+class FakeTranslator(FakeUpstream):
+    def respond(self):
+        params = self.read_params()
+        delay, failed = self.draw()
+        time.sleep(delay)
+        if failed:
+            self.send_body(503, b"unavailable", "text/html")
+            return
+        text = params.get("q", "")[::-1]
+        self.send_body(200, f'<html><body><div class="result-container">{text}</div></body></html>'.encode("utf-8"),
+                       "text/html; charset=utf-8")
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)  # the bot dropping keep-alive sockets is not news
+
+def start_server(handler, port=0):
+    server = QuietServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ================== TRAFFIC ==================
+WORDS = ["serendipity", "ephemeral", "zzxq", "ubiquitous", "laconic", "zzyzzyva", "quixotic", "sonder"]
+TOPICS = ["pizza", "the weather", "my ex", "homework", "this group", "crypto", "the new song", "mondays"]
+CHATTER = ["lol", "who's coming tonight?", "send the notes pls", "😂😂", "brb", "that's wild", "ok", "same"]
+
+class TrafficGenerator:
+    """Seeded stream of synthetic Telegram updates plus the replies each one should get"""
+
+    def __init__(self, seed, chats, users, new_user_share):
+        self.rng = random.Random(seed)
+        self.chats = [-1_000_000_000_000 - i for i in range(chats)]
+        self.users = [10_000 + i for i in range(users)]
+        self.new_user_share = new_user_share
+        self.next_new_user = 900_000
+        self.next_message_id = 1
+        self.next_callback_id = 1
+        # (weight, scenario) -- scenarios that the bot ignores on purpose still cost dispatch work
+        self.mix = [(30, "mention"), (30, "chatter"), (8, "greeting"), (8, "define"),
+                    (5, "translate"), (5, "rps"), (14, "private")]
+        self.total_weight = sum(weight for weight, _ in self.mix)
+
+    def pick_scenario(self):
+        if self.rng.random() < self.new_user_share:
+            return "verify"
+        roll = self.rng.uniform(0, self.total_weight)
+        for weight, scenario in self.mix:
+            roll -= weight
+            if roll <= 0:
+                return scenario
+        return self.mix[-1][1]
+
+    def message(self, text, chat_id, user_id):
+        self.next_message_id += 1
+        return {"message_id": self.next_message_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"}}
+
+    def next_updates(self):
+        """Return [(scenario, update, expectation)]; expectation is the key the reply is matched on"""
+        scenario = self.pick_scenario()
+        user = self.rng.choice(self.users)
+        chat = self.rng.choice(self.chats)
+        if scenario == "verify":
+            self.next_new_user += 1
+            user = self.next_new_user
+            start = self.message("/start", user, user)
+            self.next_callback_id += 1
+            callback_id = str(self.next_callback_id)
+            callback = {"callback_query": {"id": callback_id, "from": start["from"], "chat_instance": "1", "data": "verify",
+                                           "message": {**start, "text": "Join ALL my channels", "from": {"id": 1, "is_bot": True, "first_name": "T"}}}}
+            return [("start", {"message": start}, ("chat", user)), ("verify", callback, ("callback", callback_id))]
+        if scenario == "mention":
+            text = f"tristin what do you think about {self.rng.choice(TOPICS)}"
+        elif scenario == "chatter":
+            text = self.rng.choice(CHATTER)
+        elif scenario == "greeting":
+            text = self.rng.choice(["hi tristin", "hey tristin", "good morning tristin"])
+        elif scenario == "define":
+            text = f"define {self.rng.choice(WORDS)}"
+        elif scenario == "translate":
+            text = f"translate en fr {self.rng.choice(TOPICS)}"
+        elif scenario == "rps":
+            text = self.rng.choice(["rock", "paper", "scissors"])
+        else:
+            chat = user
+            text = f"what's up with {self.rng.choice(TOPICS)}"
+        message = self.message(text, chat, user)
+        expected = None if scenario == "chatter" else ("reply", chat, message["message_id"])
+        return [(scenario, {"message": message}, expected)]
+
+# ================== HARNESS ==================
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.pending = {}  # expectation key -> (scenario, injected_at)
+        self.pending_chats = defaultdict(deque)  # chat_id -> injected_at of /start messages awaiting a plain send
+        self.latencies = defaultdict(list)  # scenario -> seconds
+        self.injected = defaultdict(int)
+        self.lock = threading.Lock()
+        self.samples = []  # (threads, rss_kb), summed over every bot process
+        self.workdir = None
+        self.bots = []  # (process, port)
+        self.webhook = args.workers > 1 or args.webhook
+        self.next_update_id = 0
+        self.delivery_pool = None
+        self.refused = 0  # webhook deliveries answered with an error
+
+    # ---------- reply matching ----------
+    def on_telegram_method(self, method, params, received_at):
+        key = None
+        if method in ("sendMessage", "sendPhoto"):
+            reply_to = params.get("reply_to_message_id")
+            if not reply_to and params.get("reply_parameters"):
+                reply_to = json.loads(params["reply_parameters"]).get("message_id")
+            if reply_to:
+                key = ("reply", int(params["chat_id"]), int(reply_to))
+            else:
+                key = ("chat", int(params["chat_id"]))
+        elif method == "answerCallbackQuery":
+            key = ("callback", str(params.get("callback_query_id")))
+        if key is None:
+            return
+        with self.lock:
+            entry = self.pending.pop(key, None)
+            if entry is None and key[0] == "chat" and self.pending_chats[key[1]]:
+                entry = ("start", self.pending_chats[key[1]].popleft())
+            if entry:
+                scenario, injected_at = entry
+                self.latencies[scenario].append(received_at - injected_at)
+
+    def expect(self, scenario, expectation, injected_at):
+        if expectation is None:
+            return
+        with self.lock:
+            if expectation[0] == "chat":
+                self.pending_chats[expectation[1]].append(injected_at)
+            else:
+                self.pending[expectation] = (scenario, injected_at)
+
+    # ---------- process management ----------
+    def start_upstreams(self):
+        args = self.args
+        servers = {}
+        for index, (name, handler) in enumerate(zip(UPSTREAMS, (FakeTelegram, FakeGroq, FakeDictionary, FakeTranslator))):
+            handler.calls = handler.errors = 0  # --worker-sweep runs several tests in one process
+            handler.latency = getattr(args, f"{name}_latency")
+            handler.jitter = handler.latency * args.jitter
+            handler.error_rate = getattr(args, f"{name}_errors")
+            handler.rng = random.Random(args.seed * 100 + index)
+            servers[name] = start_server(handler)
+        FakeTelegram.on_method = self.on_telegram_method
+        return {name: f"http://127.0.0.1:{server.server_address[1]}" for name, server in servers.items()}
+
+    def start_bots(self, urls, users):
+        self.workdir = tempfile.mkdtemp(prefix="tristin-load-")
+        with open(os.path.join(self.workdir, "verified.json"), "w") as f:
+            json.dump(users, f)
+        with open(os.path.join(self.workdir, "users.json"), "w") as f:
+            json.dump({}, f)
+        for index in range(self.args.workers):
+            self.bots.append(self.start_bot(urls, index))
+        for process, port in self.bots:
+            self.wait_until_ready(process, port)
+
+    def start_bot(self, urls, index):
+        port = free_port()
+        env = {k: v for k, v in os.environ.items() if k not in ("RENDER", "WEBHOOK_URL", "STATE_BACKEND")}
+        env.update({
+            "TELEGRAM_TOKEN": "123456:LOADTEST",
+            "TELEGRAM_API_URL": urls["telegram"] + "/bot{0}/{1}",
+            "GROQ_API_KEY": "loadtest",
+            "GROQ_API_URL": urls["groq"] + "/openai/v1/chat/completions",
+            "DICTIONARY_API_URL": urls["dictionary"] + "/api/v2/entries/en/",
+            "TRANSLATOR_URL": urls["translator"] + "/m",
+            "GROQ_STREAMING": "1" if self.args.stream else "0",
+            "PORT": str(port),
+            "PYTHONUNBUFFERED": "1",
+        })
+        if self.webhook:
+            env.update({
+                "WEBHOOK_URL": "http://127.0.0.1",  # only registered with the fake Telegram
+                "WEBHOOK_SECRET": WEBHOOK_SECRET,
+                "STATE_BACKEND": f"sqlite:///{os.path.join(self.workdir, 'state.db')}",
+            })
+        for item in self.args.bot_env:
+            key, _, value = item.partition("=")
+            env[key] = value
+        log = open(os.path.join(self.workdir, f"bot{index}.log" if index else "bot.log"), "w")
+        process = subprocess.Popen([sys.executable, APP_PATH], cwd=self.workdir, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        return process, port
+
+    def wait_until_ready(self, process, port):
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"bot exited during startup, see the logs in {self.workdir}")
+            status = self.bot_status(port)
+            if status and status.get("status") == "alive":
+                return
+            time.sleep(0.1)
+        raise RuntimeError("bot did not become ready within 30s")
+
+    def bot_status(self, port):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=2) as r:
+                return json.loads(r.read())
+        except Exception:
+            return None
+
+    def deliver(self, update):
+        if not self.webhook:
+            FakeTelegram.inject(update)
+            return
+        self.next_update_id += 1
+        update["update_id"] = self.next_update_id
+        port = self.bots[self.next_update_id % len(self.bots)][1]
+        self.delivery_pool.submit(self.post_update, port, update)
+
+    def post_update(self, port, update):
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/telegram/webhook", data=json.dumps(update).encode("utf-8"),
+                                         headers={"Content-Type": "application/json",
+                                                  "X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET})
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+        except (urllib.error.URLError, OSError):
+            with self.lock:
+                self.refused += 1  # Telegram would redeliver; the harness just counts it
+
+    def sample_process(self):
+        threads = rss = 0
+        for process, _ in self.bots:
+            try:
+                with open(f"/proc/{process.pid}/status") as f:
+                    fields = dict(line.split(":", 1) for line in f if ":" in line)
+                threads += int(fields["Threads"])
+                rss += int(fields["VmRSS"].split()[0])
+            except (OSError, KeyError, ValueError):
+                return  # not Linux, or a process is gone
+        self.samples.append((threads, rss))
+
+    def stop_bots(self):
+        for process, _ in self.bots:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process, _ in self.bots:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.workdir and not self.args.keep:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    # ---------- run ----------
+    def run(self):
+        args = self.args
+        traffic = TrafficGenerator(args.seed, args.chats, args.users, args.new_user_share)
+        urls = self.start_upstreams()
+        self.delivery_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="deliver")
+        self.start_bots(urls, traffic.users)
+        try:
+            started = time.time()
+            next_at = started
+            end = started + args.duration
+            next_sample = started
+            while next_at < end:
+                now = time.time()
+                if now >= next_sample:
+                    self.sample_process()
+                    next_sample = now + 0.5
+                if next_at > now:
+                    time.sleep(min(next_at - now, 0.05))
+                    continue
+                for scenario, update, expectation in traffic.next_updates():
+                    self.injected[scenario] += 1
+                    injected_at = time.time()
+                    self.expect(scenario, expectation, injected_at)
+                    self.deliver(update)
+                next_at += traffic.rng.expovariate(args.rate)  # Poisson arrivals at the target rate
+            sent_for = time.time() - started
+
+            drain_deadline = time.time() + args.drain
+            while time.time() < drain_deadline:
+                with self.lock:
+                    waiting = len(self.pending) + sum(len(q) for q in self.pending_chats.values())
+                if not waiting:
+                    break
+                self.sample_process()
+                time.sleep(0.2)
+            self.sample_process()
+            statuses = [self.bot_status(port) or {} for _, port in self.bots]
+            return self.report(sent_for, time.time() - started, statuses)
+        finally:
+            self.delivery_pool.shutdown(wait=False)
+            self.stop_bots()
+
+    def report(self, sent_for, elapsed, statuses):
+        every = sorted(latency for values in self.latencies.values() for latency in values)
+        injected = sum(self.injected.values())
+        result = {
+            "config": {k: v for k, v in vars(self.args).items() if k not in ("json", "keep")},
+            "injected": injected,
+            "offered_rate": round(injected / sent_for, 2),
+            "replies": len(every),
+            "replies_per_sec": round(len(every) / elapsed, 2),
+            "unanswered": {scenario: count for scenario, count in self.unanswered().items() if count},
+            "latency_ms": percentiles(every),
+            "by_scenario": {scenario: {"injected": self.injected[scenario], "replies": len(values),
+                                       "latency_ms": percentiles(sorted(values))}
+                            for scenario, values in sorted(self.latencies.items())},
+            "threads_max": max((threads for threads, _ in self.samples), default=None),
+            "rss_max_mb": round(max((rss for _, rss in self.samples), default=0) / 1024, 1) or None,
+            "upstream_calls": {name: {"calls": handler.calls, "errors": handler.errors}
+                               for name, handler in zip(UPSTREAMS, (FakeTelegram, FakeGroq, FakeDictionary, FakeTranslator))},
+            "workers": len(statuses),
+            "webhook_refused": self.refused,
+            # Each worker's view of shared state; they should all agree
+            "verified_per_worker": [status.get("verified") for status in statuses],
+            "users_per_worker": [status.get("users") for status in statuses],
+            "bot": {key: statuses[0].get(key) for key in ("dispatch", "rate_limits", "ai", "persistence")},
+        }
+        if len(statuses) > 1:
+            result["bot"]["ai"] = merge_ai_stats([status.get("ai") for status in statuses])
+        return result
+
+    def unanswered(self):
+        counts = defaultdict(int)
+        with self.lock:
+            for scenario, _ in self.pending.values():
+                counts[scenario] += 1
+            counts["start"] += sum(len(q) for q in self.pending_chats.values())
+        return counts
+
+def merge_ai_stats(stats):
+    stats = [s for s in stats if s]
+    if not stats:
+        return None
+    hits = sum(s["reply_cache"]["hits"] for s in stats)
+    misses = sum(s["reply_cache"]["misses"] for s in stats)
+    return {"llm_calls": sum(s["llm_calls"] for s in stats), "llm_calls_saved": sum(s["llm_calls_saved"] for s in stats),
+            "llm_failures": sum(s["llm_failures"] for s in stats),
+            "reply_cache": {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0}}
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 1)
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(values[-1] * 1000, 1)}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def print_report(result):
+    latency = result["latency_ms"]
+    print("\n" + "=" * 60)
+    print(f"📨 Injected {result['injected']} messages at {result['offered_rate']}/s, "
+          f"{result['replies']} replies ({result['replies_per_sec']}/s)")
+    print(f"⏱ Reply latency p50 {latency['p50']} ms | p95 {latency['p95']} ms | p99 {latency['p99']} ms | max {latency['max']} ms")
+    print(f"🧵 Threads (max) {result['threads_max']} | 💾 RSS (max) {result['rss_max_mb']} MB")
+    if result["workers"] > 1 or result["webhook_refused"]:
+        print(f"👷 Workers {result['workers']} | webhook deliveries refused {result['webhook_refused']} "
+              f"| verified per worker {result['verified_per_worker']} | users per worker {result['users_per_worker']}")
+    print("-" * 60)
+    for scenario, stats in result["by_scenario"].items():
+        l = stats["latency_ms"]
+        print(f"   {scenario:<10} {stats['replies']:>5}/{stats['injected']:<5} p50 {l['p50']:>8} p95 {l['p95']:>8} p99 {l['p99']:>8}")
+    if result["unanswered"]:
+        print(f"   unanswered: {result['unanswered']}")
+    print(f"   upstream calls: {result['upstream_calls']}")
+    ai = result["bot"].get("ai")
+    if ai:
+        print(f"   llm calls {ai['llm_calls']} | saved by reply cache {ai['llm_calls_saved']} "
+              f"| reply cache hit rate {ai['reply_cache']['hit_rate']}")
+    print("=" * 60)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rate", type=float, default=20, help="target messages per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic")
+    parser.add_argument("--drain", type=float, default=15, help="seconds to wait for outstanding replies")
+    parser.add_argument("--chats", type=int, default=20, help="group chats")
+    parser.add_argument("--users", type=int, default=200, help="verified users")
+    parser.add_argument("--new-user-share", type=float, default=0.02, help="share of arrivals that are a new user's /start + verify")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stream", action="store_true", help="run the bot with GROQ_STREAMING=1")
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency stddev as a fraction of the mean")
+    defaults = {"telegram": 0.03, "groq": 0.6, "dictionary": 0.15, "translator": 0.25}
+    for name in UPSTREAMS:
+        parser.add_argument(f"--{name}-latency", type=float, default=defaults[name], help=f"mean {name} latency in seconds")
+        parser.add_argument(f"--{name}-errors", type=float, default=0.0, help=f"share of {name} calls that fail")
+    parser.add_argument("--workers", type=int, default=1, help="bot processes; more than one runs in webhook mode on a shared SQLite backend")
+    parser.add_argument("--webhook", action="store_true", help="webhook mode (shared SQLite backend) even for a single worker")
+    parser.add_argument("--worker-sweep", action="store_true", help=f"run with {', '.join(map(str, SWEEP_WORKERS))} workers and compare throughput")
+    parser.add_argument("--bot-env", action="append", default=[], metavar="KEY=VALUE", help="extra environment for the bot")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory and bot.log")
+    return parser.parse_args(argv)
+
+def run_worker_sweep(args):
+    results = []
+    for workers in SWEEP_WORKERS:
+        run_args = argparse.Namespace(**{**vars(args), "workers": workers, "webhook": True})
+        result = LoadTest(run_args).run()
+        print_report(result)
+        results.append(result)
+    print(f"\n{'workers':>8} {'replies/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'refused':>8} {'RSS MB':>8}")
+    for result in results:
+        latency = result["latency_ms"]
+        print(f"{result['workers']:>8} {result['replies_per_sec']:>10} {latency['p50']:>9} {latency['p95']:>9} "
+              f"{result['webhook_refused']:>8} {result['rss_max_mb']:>8}")
+    return {"sweep": results}
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.worker_sweep:
+        result = run_worker_sweep(args)
+    else:
+        result = LoadTest(args).run()
+        print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"💾 Results written to {args.json}")
@@ -0,0 +1,16 @@
+"""Import setup shared by the tests and the bench_*.py scripts.
+
+app.py is a script module: importing it reads the environment, loads and
+saves its JSON files in the working directory and starts warming up in the
+background. This gives it a token, a Telegram URL nothing listens on (warm-up
+just keeps retrying getMe) and a scratch directory so nothing touches real data.
+"""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123:test")
+os.environ.setdefault("TELEGRAM_API_URL", "http://127.0.0.1:9/bot{0}/{1}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SCRATCH_DIR = tempfile.mkdtemp(prefix="tristin-tests-")
+os.chdir(SCRATCH_DIR)
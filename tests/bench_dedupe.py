@@ -0,0 +1,42 @@
+"""Dedupe memory and per-message cost at millions of messages.
+
+    python tests/bench_dedupe.py [messages]
+
+Feeds DedupeWindow at the default PROCESSED_MESSAGE_MAX with message IDs
+spread over 5000 group chats, all inside one window so only the size bound
+rotates generations, and reports the traced memory it holds.
+"""
+import sys
+import time
+import tracemalloc
+
+import appenv  # noqa: F401  (must run before app is imported)
+import app
+
+
+def fill(messages):
+    seen = app.DedupeWindow(3600, app.PROCESSED_MESSAGE_MAX)
+    for i in range(messages):
+        seen.add((-1000000000000 - i % 5000, i))
+    return seen
+
+
+def main(messages=3_000_000):
+    started = time.perf_counter()
+    seen = fill(messages)
+    add_cost = (time.perf_counter() - started) / messages
+    started = time.perf_counter()
+    recent = sum((-1000000000000 - i % 5000, i) in seen for i in range(messages - 100_000, messages))
+    check_cost = (time.perf_counter() - started) / 100_000
+    del seen
+    tracemalloc.start()  # a second run, since tracing slows every allocation down
+    seen = fill(messages)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{messages:,} messages: {add_cost * 1e9:.0f} ns/add, {check_cost * 1e9:.0f} ns/check, "
+          f"recent hits {recent}/100000, keys {len(seen):,} (cap {app.PROCESSED_MESSAGE_MAX:,}), "
+          f"early rotations {seen.early_rotations}, memory {current / 1e6:.1f} MB (peak {peak / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,66 @@
+"""Acronym expansion plus greeting lookup per message, token trie vs the old helpers.
+
+    python tests/bench_phrases.py
+
+"new" is match_phrases + get_common_response as process_ai_request calls them;
+"old" is the expand_acronyms / get_common_response pair they replaced, copied
+below as they were.
+"""
+import random
+import timeit
+
+import appenv  # noqa: F401  (must run before app is imported)
+import app
+
+MESSAGES = ["hey tristin how are you", "lol that's wild", "wyd tonight", "can you explain quantum physics",
+            "idk what to eat rn", "thank you so much", "yo", "what do you think about the new album",
+            "omg did you see that", "tbh i'm bored", "hru", "tell me a joke", "nvm forget it",
+            "whats up with you today", "good morning everyone", "so how are you doing lately"]
+
+
+def old_expand_acronyms(text):
+    words = text.split()
+    expanded = []
+    for word in words:
+        clean = ''.join(c for c in word.lower() if c.isalnum())
+        expanded.append(app.COMMON_ACRONYMS.get(clean, word))
+    return ' '.join(expanded)
+
+
+def old_get_common_response(message):
+    msg = message.lower().strip()
+    if msg in app.COMMON_GREETINGS:
+        return random.choice(app.COMMON_GREETINGS[msg])
+    words = msg.split()
+    for word in words:
+        if word in app.COMMON_GREETINGS:
+            return random.choice(app.COMMON_GREETINGS[word])
+    if 'ranger' in msg or 'assemble' in msg:
+        return random.choice(app.COMMON_GREETINGS.get('rangers', ["What's good? 🤔"]))
+    return None
+
+
+def run_new(texts):
+    for text in texts:
+        expanded, greeting = app.match_phrases(text)
+        app.get_common_response(greeting, expanded)
+
+
+def run_old(texts):
+    for text in texts:
+        old_get_common_response(old_expand_acronyms(text))
+
+
+def main():
+    rng = random.Random(7)
+    texts = [rng.choice(MESSAGES) for _ in range(10_000)]
+    best = {"new": float("inf"), "old": float("inf")}
+    for _ in range(10):  # interleaved so drift hits both alike
+        best["new"] = min(best["new"], timeit.timeit(lambda: run_new(texts), number=1))
+        best["old"] = min(best["old"], timeit.timeit(lambda: run_old(texts), number=1))
+    for label, seconds in best.items():
+        print(f"{label}: {seconds / len(texts) * 1e6:.2f}us/msg")
+
+
+if __name__ == "__main__":
+    main()
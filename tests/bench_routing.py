@@ -0,0 +1,94 @@
+"""Per-message routing cost over a synthetic group-chat corpus.
+
+    python tests/bench_routing.py
+
+"new" is what every text message now costs before a handler does real work:
+the rps/define/translate filters plus handle_chat's trigger checks, all
+reading one parse_route result. "old" is the chain they replaced: each filter
+lowercasing the text again, then handle_chat's @mention test and `any()` over
+the name triggers.
+"""
+import random
+import re
+import timeit
+from types import SimpleNamespace
+
+import appenv  # noqa: F401  (must run before app is imported)
+import app
+
+CHATTER = ["lol", "bro what", "nah that's crazy", "who's coming tonight", "i'm so tired fr",
+           "did anyone see the game", "send the link", "wyd", "omg same", "that movie was mid",
+           "brb", "can someone explain this meme", "ok but why tho", "haha yes", "who took my charger"]
+ADDRESSED = ["tristin what do you think", "@{bot} hi", "miss tristin are you real", "derieri help",
+             "yo tristin", "ok @{bot} settle this"]
+COMMANDS = ["rock", "paper", "define ephemeral", "translate en fr hello", "/start"]
+
+
+def corpus(size=10_000, seed=7):
+    """About 85% plain chatter, 10% addressed to the bot, 5% commands"""
+    rng = random.Random(seed)
+    bot = app.BOT_USERNAME
+    texts = []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < 0.85:
+            texts.append(rng.choice(CHATTER))
+        elif roll < 0.95:
+            texts.append(rng.choice(ADDRESSED).format(bot=bot))
+        else:
+            texts.append(rng.choice(COMMANDS))
+    return texts
+
+
+def route_new(message, filters=(app.is_route('rps'), app.is_route('define'), app.is_route('translate'))):
+    for accepts in filters:
+        if accepts(message):
+            return
+    route = app.route_message(message)
+    return route.kind == 'command' or route.mention_text is not None or route.name_text is not None
+
+
+def route_old(message, triggers=('tristin', 'derieri', 'miss tristin')):
+    text = message.text
+    if text and text.lower() in ['rock', 'paper', 'scissors']:
+        return
+    if text and text.lower().startswith('define '):
+        return
+    if text and text.lower().startswith('translate '):
+        return
+    if text.startswith('/'):
+        return
+    mention = f"@{app.BOT_USERNAME}"
+    if mention.lower() in text.lower():
+        return re.sub(re.escape(mention), '', text, flags=re.IGNORECASE).strip()
+    if any(t in text.lower() for t in triggers):
+        clean = text
+        for t in triggers:
+            clean = re.sub(re.escape(t), '', clean, flags=re.IGNORECASE).strip()
+        return clean
+
+
+def per_message(routes, texts, repeat=15):
+    """Best-of-repeat seconds per message for each route function, interleaved so drift hits both alike"""
+    best = [float("inf")] * len(routes)
+    for _ in range(repeat):
+        for i, route in enumerate(routes):
+            messages = [SimpleNamespace(text=text) for text in texts]  # fresh, so no cached routes
+            best[i] = min(best[i], timeit.timeit(lambda: [route(m) for m in messages], number=1))
+    return [b / len(texts) for b in best]
+
+
+def main():
+    app.BOT_USERNAME = "tristin_bot"  # getMe never answers here
+    app.compile_triggers(app.BOT_USERNAME)
+    texts = corpus()
+    plain = [t for t in texts if t in CHATTER]
+    addressed = [t for t in texts if t not in CHATTER]
+    print(f"{'':<20} {'new':>9} {'old':>9}")
+    for label, subset in (("plain chatter", plain), ("addressed/commands", addressed), ("whole corpus", texts)):
+        new, old = per_message((route_new, route_old), subset)
+        print(f"{label:<20} {new * 1e6:>7.2f}us {old * 1e6:>7.2f}us")
+
+
+if __name__ == "__main__":
+    main()
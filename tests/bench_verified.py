@@ -0,0 +1,33 @@
+"""Verified-user lookup cost at growing verified counts.
+
+    python tests/bench_verified.py
+
+Compares is_user_verified (set of normalized int IDs) with the old
+`str(user_id) in verified_users` scan over a list. Misses are timed because
+they are the worst case for the scan and the common case for the handlers.
+"""
+import timeit
+
+import appenv  # noqa: F401  (must run before app is imported)
+import app
+
+SIZES = (1_000, 100_000, 1_000_000)
+
+
+def per_call(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def main():
+    print(f"{'verified':>10} {'set':>10} {'old list':>12}")
+    for size in SIZES:
+        app.verified_users = set(range(10**9, 10**9 + size))
+        old_list = [str(uid) for uid in app.verified_users]
+        missing = "42"
+        new = per_call(lambda: app.is_user_verified(missing), 100_000)
+        old = per_call(lambda: missing in old_list, max(1, 10_000_000 // size))
+        print(f"{size:>10} {new * 1e9:>8.0f}ns {old * 1e6:>10.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+
+from appenv import SCRATCH_DIR
+
+
+def pytest_unconfigure(config):
+    # pytest switches back to the starting directory at the end of the session;
+    # return to the scratch one so app's atexit save and flusher write there
+    os.chdir(SCRATCH_DIR)
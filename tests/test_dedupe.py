@@ -0,0 +1,68 @@
+import app
+from app import DedupeWindow
+
+
+def test_same_message_id_in_two_chats_is_not_a_duplicate():
+    seen = DedupeWindow(60, 1000)
+    seen.add((-1001234567890, 42))
+    assert (-1001234567890, 42) in seen
+    assert (-1001234567891, 42) not in seen
+    assert (555, 42) not in seen
+
+
+def test_same_pair_is_a_duplicate():
+    seen = DedupeWindow(60, 1000)
+    seen.add((555, 42))
+    assert (555, 42) in seen
+    assert (555, 43) not in seen
+
+
+def test_message_ids_past_32_bits_do_not_collide():
+    seen = DedupeWindow(60, 1000)
+    seen.add((2, 1 << 32))
+    assert (2, 1 << 32) in seen
+    assert (2, 0) not in seen
+    assert (3, 0) not in seen
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entry_survives_one_window_and_expires_after_two():
+    clock = FakeClock()
+    seen = DedupeWindow(60, 1000, clock)
+    seen.add((1, 1))
+    clock.now += 30
+    seen.add((1, 2))
+    clock.now += 40  # first rotation: both move to the previous generation
+    assert (1, 1) in seen and (1, 2) in seen
+    clock.now += 60  # second rotation drops them
+    assert (1, 1) not in seen and (1, 2) not in seen
+
+
+def test_quiet_for_two_windows_forgets_everything():
+    clock = FakeClock()
+    seen = DedupeWindow(60, 1000, clock)
+    seen.add((1, 1))
+    clock.now += 121
+    assert (1, 1) not in seen
+    assert len(seen) == 0
+
+
+def test_size_is_bounded_by_max_entries():
+    seen = DedupeWindow(60, 100)
+    for message_id in range(1000):
+        seen.add((-100, message_id))
+    assert len(seen) <= 100
+    assert seen.early_rotations > 0
+    assert (-100, 999) in seen
+    assert (-100, 0) not in seen
+
+
+def test_processed_messages_uses_the_configured_bound():
+    assert app.processed_messages.generation_size == app.PROCESSED_MESSAGE_MAX // 2
@@ -0,0 +1,22 @@
+import threading
+import time
+
+import app
+
+
+def test_thread_count_stays_flat_under_many_responses():
+    app.mark_response_sent(1, -1, 0)  # let anything lazy start first
+    before = threading.active_count()
+    started = time.perf_counter()
+    for message_id in range(1, 20_001):
+        app.mark_response_sent(message_id % 500, -(message_id % 50) - 1, message_id)
+    elapsed = time.perf_counter() - started
+    assert threading.active_count() <= before
+    print(f"20k responses in {elapsed:.2f}s, threads {before} -> {threading.active_count()}")
+
+
+def test_wheel_fires_callbacks_after_their_delay():
+    fired = threading.Event()
+    app.schedule_expiry(0.2, fired.set)
+    assert not fired.is_set()
+    assert fired.wait(3)
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import app
+
+
+def fake_members(monkeypatch, status="member"):
+    calls = []
+
+    def get_chat_member(channel, user_id):
+        calls.append((channel, user_id))
+        return SimpleNamespace(status=status)
+
+    monkeypatch.setattr(app.bot, "get_chat_member", get_chat_member)
+    return calls
+
+
+def test_cache_is_capped(monkeypatch):
+    fake_members(monkeypatch)
+    monkeypatch.setattr(app, "membership_cache", app.TTLCache(100, 600, 15))
+    for user_id in range(1000):
+        assert app.check_channel_membership(user_id, "chan") is True
+    assert app.membership_cache.stats()["size"] == 100
+
+
+def test_click_path_uses_the_cache(monkeypatch):
+    calls = fake_members(monkeypatch)
+    monkeypatch.setattr(app, "membership_cache", app.TTLCache(100, 600, 15))
+    app.check_channel_membership(5, "chan")
+    app.check_channel_membership(5, "chan")
+    assert len(calls) == 1
+
+
+def test_background_recheck_does_not_fill_the_cache(monkeypatch):
+    calls = fake_members(monkeypatch)
+    monkeypatch.setattr(app, "membership_cache", app.TTLCache(100, 600, 15))
+    for user_id in range(50):
+        app.check_channel_membership(user_id, "chan", use_cache=False)
+    assert app.membership_cache.stats()["size"] == 0
+    assert len(calls) == 50
+
+
+def test_background_recheck_drops_a_leavers_cached_membership(monkeypatch):
+    fake_members(monkeypatch, "member")
+    monkeypatch.setattr(app, "membership_cache", app.TTLCache(100, 600, 15))
+    app.check_channel_membership(7, "chan")
+    fake_members(monkeypatch, "left")
+    assert app.check_channel_membership(7, "chan", use_cache=False) is False
+    assert app.check_channel_membership(7, "chan") is False
@@ -0,0 +1,13 @@
+import app
+
+
+def test_label_values_are_escaped():
+    assert app.escape_label_value('a\\b') == 'a\\\\b'
+    assert app.escape_label_value('say "hi"') == 'say \\"hi\\"'
+    assert app.escape_label_value('two\nlines') == 'two\\nlines'
+    assert app.escape_label_value(42) == '42'
+
+
+def test_format_labels():
+    assert app.format_labels(()) == ""
+    assert app.format_labels((("handler", "chat"), ("reason", 'x"\n'))) == '{handler="chat",reason="x\\"\\n"}'
@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+import app
+
+
+def test_wait_is_bounded_when_a_429_retry_is_queued(monkeypatch):
+    monkeypatch.setattr(app, "SEND_WAIT_TIMEOUT", 0.5)
+    calls = []
+
+    def rate_limited():
+        calls.append(time.monotonic())
+        raise app.RetryAfter(4)
+
+    started = time.monotonic()
+    future = app.outbound.submit("-7001", app.PRIORITY_REPLY, rate_limited)
+    with pytest.raises(app.SendSkipped):
+        app.wait_sent(future)
+    assert time.monotonic() - started < 1.5
+    time.sleep(0.2)
+    assert len(calls) == 1  # the abandoned retry is never sent
+
+
+def test_wait_returns_the_result_of_a_prompt_send():
+    future = app.outbound.submit("-7002", app.PRIORITY_REPLY, lambda: "sent")
+    assert app.wait_sent(future) == "sent"
+
+
+def test_queued_send_is_dropped_once_abandoned(monkeypatch):
+    monkeypatch.setattr(app, "SEND_WAIT_TIMEOUT", 0.3)
+    calls = []
+    app.outbound.submit("-7003", app.PRIORITY_REPLY, time.sleep, (1,))
+    late = app.outbound.submit("-7003", app.PRIORITY_REPLY, calls.append, ("late",))
+    with pytest.raises(app.SendSkipped):
+        app.wait_sent(late)
+    time.sleep(1.2)
+    assert calls == []
+
+
+def test_typing_does_not_spend_chat_tokens():
+    for _ in range(app.SEND_CHAT_BURST + 2):
+        app.outbound.submit("-7004", app.PRIORITY_TYPING, lambda: None).result(timeout=2)
+    assert app.outbound.outboxes["-7004"].tokens >= app.SEND_CHAT_BURST - 0.01
@@ -0,0 +1,42 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def greetings(monkeypatch):
+    monkeypatch.setattr(app, "COMMON_GREETINGS", {"good": ["a"], "good morning": ["b"], "morning": ["c"],
+                                                  "how are you": ["d"]})
+    app.compile_phrases()
+    yield
+    monkeypatch.undo()
+    app.compile_phrases()
+
+
+def test_multi_word_greeting_found_mid_message(greetings):
+    assert app.match_phrases("ok so how are you doing")[1] == "how are you"
+
+
+def test_earliest_start_wins(greetings):
+    assert app.match_phrases("well morning is good")[1] == "morning"
+
+
+def test_longest_wins_at_the_same_start(greetings):
+    assert app.match_phrases("good morning all")[1] == "good morning"
+    assert app.match_phrases("good evening")[1] == "good"
+
+
+def test_partial_phrase_is_no_match(greetings):
+    assert app.match_phrases("how are things")[1] is None
+
+
+def test_acronyms_expand_and_feed_greetings():
+    expanded, greeting = app.match_phrases("hru")
+    assert expanded == "how are you"
+    assert greeting == "how are you"
+    assert app.match_phrases("idk tbh")[0] == "i don't know to be honest"
+
+
+def test_punctuation_and_case_are_ignored():
+    assert app.match_phrases("Hello!")[1] == "hello"
+    assert app.match_phrases("What's up?")[1] == "whats up"
@@ -0,0 +1,36 @@
+import app
+
+
+def test_replies_with_history_are_never_shared(monkeypatch):
+    calls = []
+
+    def fake_groq(prompt, user_id=None, chat_id=None, on_delta=None, max_chars=200):
+        calls.append(user_id)
+        return f"reply {len(calls)} for {user_id}"
+
+    monkeypatch.setattr(app, "ask_groq", fake_groq)
+    monkeypatch.setattr(app, "reply_cache", app.TTLCache(100, 60))
+    app.add_to_history(1001, 1001, "my name is alice", "cute name alice")
+
+    for _ in range(app.REPLY_CACHE_VARIANTS + 1):
+        assert "1001" in app.ask_groq_cached("whats my name", 1001, 1001)
+    # Another user, mid-conversation in a group, never gets those replies
+    app.add_to_history(2002, -500, "hi", "hey")
+    assert "1001" not in app.ask_groq_cached("whats my name", 2002, -500)
+    assert calls[-1] == 2002
+
+
+def test_fresh_chatter_is_served_from_cache(monkeypatch):
+    calls = []
+
+    def fake_groq(prompt, user_id=None, chat_id=None, on_delta=None, max_chars=200):
+        calls.append(user_id)
+        return f"variant {len(calls)}"
+
+    monkeypatch.setattr(app, "ask_groq", fake_groq)
+    monkeypatch.setattr(app, "reply_cache", app.TTLCache(100, 60))
+    for user_id in range(3001, 3001 + app.REPLY_CACHE_VARIANTS):
+        app.ask_groq_cached("yo whats up", user_id, user_id)
+    assert calls == [None] * app.REPLY_CACHE_VARIANTS
+    assert app.ask_groq_cached("Yo, what's up?", 4001, -600).startswith("variant")
+    assert len(calls) == app.REPLY_CACHE_VARIANTS
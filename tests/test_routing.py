@@ -0,0 +1,42 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(autouse=True)
+def username(monkeypatch):
+    monkeypatch.setattr(app, "BOT_USERNAME", "tristin_bot")
+    app.compile_triggers("tristin_bot")
+    yield
+    app.compile_triggers(None)
+
+
+def test_plain_chatter_shares_one_route():
+    assert app.parse_route("did anyone see the game") is app.NOT_FOR_US
+    assert app.parse_route("who's coming tonight") is app.NOT_FOR_US
+
+
+def test_commands():
+    assert app.parse_route("/start").kind == "command"
+    assert app.parse_route("Rock").kind == "rps"
+    route = app.parse_route("Define Ephemeral")
+    assert (route.kind, route.arg) == ("define", "Ephemeral")
+    route = app.parse_route("translate en fr Hello there")
+    assert (route.kind, route.arg) == ("translate", "en fr Hello there")
+    assert app.parse_route("definitely not").kind == "chat"
+
+
+def test_triggers_are_cut_out():
+    route = app.parse_route("ok @Tristin_Bot settle this")
+    assert route.mention_text == "ok settle this"
+    assert route.name_text is None
+    route = app.parse_route("Miss Tristin are you real")
+    assert route.name_text == "are you real"
+    assert app.parse_route("yo derieri").name_text == "yo"
+
+
+def test_filters_read_the_cached_route():
+    message = type("M", (), {"text": "paper"})()
+    assert app.is_route("rps")(message)
+    assert not app.is_route("define")(message)
+    assert message.route.kind == "rps"
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return app.MemoryStateBackend()
+    if request.param == "sqlite":
+        return app.SQLiteStateBackend(str(tmp_path / "state.db"))
+    fakeredis = pytest.importorskip("fakeredis")
+    return app.RedisStateBackend(fakeredis.FakeRedis())
+
+
+def test_claim(backend):
+    assert backend.claim("k", 0.2)
+    assert not backend.claim("k", 0.2)
+    time.sleep(0.25)
+    assert backend.claim("k", 0.2)
+
+
+def test_hit_and_recent(backend):
+    assert backend.recent("spam", 1) == 0
+    assert backend.hit("spam", 1) == 1
+    assert backend.hit("spam", 1) == 2
+    assert backend.recent("spam", 1) == 2
+    assert backend.recent("other", 1) == 0
+    time.sleep(1.05)
+    assert backend.recent("spam", 1) == 0
+    assert backend.hit("spam", 1) == 1
+
+
+def test_sets(backend):
+    assert backend.add("users", "1")
+    assert not backend.add("users", "1")
+    assert backend.add("users", "2")
+    assert backend.contains("users", "1")
+    assert sorted(backend.members("users")) == ["1", "2"]
+    assert backend.count("users") == 2
+    assert backend.remove("users", "1")
+    assert not backend.remove("users", "1")
+    assert backend.count("users") == 1
+
+
+def test_incr_get_set(backend):
+    assert backend.incr("n") == 1
+    assert backend.incr("n", 4) == 5
+    assert int(backend.get("n")) == 5
+    backend.set("v", "x")
+    assert backend.get("v") == "x"
+    backend.delete("v")
+    assert backend.get("v") is None
+
+
+@pytest.fixture
+def shared(monkeypatch, backend):
+    if not backend.shared:
+        pytest.skip("in-process backend")
+    monkeypatch.setattr(app, "state_backend", backend)
+    return backend
+
+
+def test_spam_rejection_leaves_the_chat_cooldown_alone(shared):
+    for _ in range(app.SPAM_THRESHOLD):
+        shared.hit("spam:1", app.SPAM_WINDOW)
+    assert not app.claim_shared_response(1, -100, 1)
+    assert app.claim_shared_response(2, -100, 2)  # another user still gets a reply
+
+
+def test_rejected_messages_do_not_extend_a_spam_block(shared, monkeypatch):
+    monkeypatch.setattr(app, "SPAM_WINDOW", 1)
+    for message_id in range(app.SPAM_THRESHOLD + 2):
+        assert app.claim_shared_response(1, 1, message_id)
+    time.sleep(0.5)
+    for message_id in range(100, 120):
+        assert not app.claim_shared_response(1, 1, message_id)
+    time.sleep(0.6)  # the answered ones have left the window; the rejected ones must not count
+    assert app.claim_shared_response(1, 1, 200)
+
+
+def test_chat_cooldown_rejection_releases_the_user_cooldown(shared):
+    assert shared.claim("cool:chat:-100", 60)
+    assert not app.claim_shared_response(1, -100, 1)
+    assert not shared.claim("cool:chat:-100", 60)
+    assert shared.claim("cool:user:1", 60)
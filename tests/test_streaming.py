@@ -0,0 +1,37 @@
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import app
+
+
+def posted_stream(monkeypatch, edit_result):
+    edits = []
+    first = Future()
+    first.set_result(SimpleNamespace(chat=SimpleNamespace(id=-800), message_id=9))
+    monkeypatch.setattr(app, "queue_reply", lambda message, text, **kwargs: first)
+    monkeypatch.setattr(app, "safe_edit_message", lambda *args, **kwargs: edits.append(args) or edit_result)
+    stream = app.StreamingReply(SimpleNamespace(chat=SimpleNamespace(id=-800)))
+    stream.update("x" * app.STREAM_FIRST_CHARS)
+    return stream, edits
+
+
+def test_finish_reports_a_failed_final_edit(monkeypatch):
+    stream, edits = posted_stream(monkeypatch, edit_result=False)
+    assert stream.finish("the whole reply, longer than what was streamed") is False
+    assert len(edits) == 1
+
+
+def test_finish_after_final_edit(monkeypatch):
+    stream, edits = posted_stream(monkeypatch, edit_result=True)
+    assert stream.finish("the whole reply, longer than what was streamed") is True
+
+
+def test_finish_without_edit_when_text_is_already_shown(monkeypatch):
+    stream, edits = posted_stream(monkeypatch, edit_result=False)
+    assert stream.finish("x" * app.STREAM_FIRST_CHARS) is True
+    assert edits == []
+
+
+def test_finish_before_anything_was_posted():
+    stream = app.StreamingReply(SimpleNamespace(chat=SimpleNamespace(id=-800)))
+    assert stream.finish("short") is False
@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def translator(monkeypatch):
+    requests_made = []
+
+    def fake_request(upstream, method, url, **kwargs):
+        requests_made.append((upstream, kwargs["params"]))
+        return SimpleNamespace(status_code=200, text='<div class="result-container">Bonjour</div>')
+
+    monkeypatch.setattr(app, "http_request", fake_request)
+    monkeypatch.setattr(app, "translate_cache", app.TTLCache(10, 60))
+    return requests_made
+
+
+def test_translation_goes_through_http_request(translator):
+    assert app.translate_text("en", "fr", "Hello") == "Bonjour"
+    assert translator == [("translator", {"sl": "en", "tl": "fr", "q": "Hello"})]
+    assert app.translate_text("en", "fr", "Hello") == "Bonjour"
+    assert len(translator) == 1  # cached
+
+
+def test_unknown_language_is_rejected_without_a_request(translator):
+    with pytest.raises(ValueError):
+        app.translate_text("en", "xx", "Hello")
+    assert translator == []
@@ -0,0 +1,17 @@
+import app
+from bench_verified import per_call
+
+
+def test_lookup_accepts_str_and_int_ids(monkeypatch):
+    monkeypatch.setattr(app, "verified_users", {8153349947})
+    assert app.is_user_verified(8153349947)
+    assert app.is_user_verified("8153349947")
+    assert not app.is_user_verified("42")
+
+
+def test_lookup_cost_does_not_grow_with_verified_count(monkeypatch):
+    costs = []
+    for size in (1_000, 200_000):
+        monkeypatch.setattr(app, "verified_users", set(range(10**9, 10**9 + size)))
+        costs.append(per_call(lambda: app.is_user_verified("42"), 20_000))
+    assert costs[1] < costs[0] * 5  # a scan would be ~200x slower